@@ -0,0 +1,229 @@
+"""
+Offline benchmarks for the TempVenv lifecycle.
+
+Every package is a locally generated wheel installed with --no-index, so runs
+need no network and are comparable across commits and machines. uv's cache is
+pointed at a private directory that is warmed before measuring, so the numbers
+describe steady-state builds rather than first-time downloads. Scenarios only
+use TempVenv's constructor and with block, so the script also runs against
+commits that predate later APIs, such as a baseline checkout.
+
+Usage:
+    python benchmark_temp_venv.py                       # run everything, print a table
+    python benchmark_temp_venv.py --output base.json    # also save the results
+    python benchmark_temp_venv.py --compare base.json   # show the change against saved results
+    python benchmark_temp_venv.py --scenarios cold_create churn --repeat 10
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import temp_venv
+from temp_venv import TempVenv
+
+
+def make_wheel(wheel_dir, name, version="1.0", requires=(), modules=1, module_size=0):
+    """
+    Writes a pure-Python wheel with a console script, so packages can be
+    installed offline. The tests use it too. modules is the total number of
+    modules; the extra ones are padded to module_size bytes.
+    """
+    dist_info = f"{name}-{version}.dist-info"
+    requires_dist = "".join(f"Requires-Dist: {requirement}\n" for requirement in requires)
+    files = {f"{name}/__init__.py": f"__version__ = '{version}'\ndef main():\n    print('{name} {version}')\n"}
+    for index in range(1, modules):
+        files[f"{name}/module_{index}.py"] = f"VALUE = {index}\n" + "#" * module_size + "\n"
+    files[f"{dist_info}/METADATA"] = f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n{requires_dist}"
+    files[f"{dist_info}/WHEEL"] = "Wheel-Version: 1.0\nGenerator: benchmark_temp_venv\nRoot-Is-Purelib: true\nTag: py3-none-any\n"
+    files[f"{dist_info}/entry_points.txt"] = f"[console_scripts]\n{name}-cli = {name}:main\n"
+    wheel_path = Path(wheel_dir) / f"{name}-{version}-py3-none-any.whl"
+    records = []
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        for arcname, content in files.items():
+            wheel.writestr(arcname, content)
+            digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode()).digest()).rstrip(b"=").decode()
+            records.append(f"{arcname},sha256={digest},{len(content)}")
+        records.append(f"{dist_info}/RECORD,,")
+        wheel.writestr(f"{dist_info}/RECORD", "\n".join(records) + "\n")
+    return wheel_path
+
+
+class Benchmark:
+    def __init__(self, work_dir, packages, large_modules, concurrent_envs):
+        self.wheel_dir = Path(work_dir) / "wheels"
+        self.wheel_dir.mkdir()
+        self.package_names = [f"benchpkg{index}" for index in range(packages)]
+        for name in self.package_names:
+            make_wheel(self.wheel_dir, name, modules=5)
+        make_wheel(self.wheel_dir, "benchlarge", modules=large_modules, module_size=4096)
+        self.pip_options = ["--no-index", "--find-links", str(self.wheel_dir)]
+        self.concurrent_envs = concurrent_envs
+
+    def _build(self, **kwargs):
+        kwargs.setdefault("pip_options", self.pip_options)
+        with TempVenv(**kwargs) as venv_python:
+            pass
+        return venv_python
+
+    def cold_create(self):
+        """Create and remove an environment with no packages."""
+        start = time.perf_counter()
+        self._build()
+        return time.perf_counter() - start
+
+    def create_with_packages(self):
+        """Create an environment and install every generated package into it."""
+        start = time.perf_counter()
+        self._build(packages=self.package_names)
+        return time.perf_counter() - start
+
+    def churn(self):
+        """Ten consecutive enter/exit cycles with one package, reported per cycle."""
+        start = time.perf_counter()
+        for _ in range(10):
+            self._build(packages=self.package_names[:1])
+        return (time.perf_counter() - start) / 10
+
+    def _concurrent(self, workers):
+        names = self.package_names[:self.concurrent_envs]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda name: self._build(packages=[name]), names))
+        return time.perf_counter() - start
+
+    def concurrent_1(self):
+        """Build the concurrent batch with one worker."""
+        return self._concurrent(1)
+
+    def concurrent_4(self):
+        """Build the concurrent batch with four workers."""
+        return self._concurrent(4)
+
+    def concurrent_16(self):
+        """Build the concurrent batch with sixteen workers."""
+        return self._concurrent(16)
+
+    def _cleanup(self, **kwargs):
+        venv = TempVenv(packages=["benchlarge"], pip_options=self.pip_options, **kwargs)
+        venv.__enter__()
+        start = time.perf_counter()
+        venv.__exit__(None, None, None)
+        return time.perf_counter() - start
+
+    def cleanup_large(self):
+        """Time only the __exit__ of an environment holding one large package."""
+        return self._cleanup()
+
+    def cleanup_large_background(self):
+        """Time only the __exit__ of the same environment with cleanup="background"."""
+        return self._cleanup(cleanup="background")
+
+
+SCENARIOS = ["cold_create", "create_with_packages", "churn", "concurrent_1", "concurrent_4", "concurrent_16", "cleanup_large",
+             "cleanup_large_background"]
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(temp_venv.__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    uv_version = subprocess.run([sys.executable, "-m", "uv", "--version"], capture_output=True, text=True).stdout.strip()
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "uv": uv_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def _summarize(runs):
+    return {
+        "runs": runs,
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+        "min": min(runs),
+        "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+    }
+
+
+def run(scenarios, repeat, warmup, packages, large_modules, concurrent_envs):
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        previous_cache_dir = os.environ.get("UV_CACHE_DIR")
+        os.environ["UV_CACHE_DIR"] = os.path.join(work_dir, "uv-cache")
+        try:
+            benchmark = Benchmark(work_dir, packages, large_modules, concurrent_envs)
+            for scenario in scenarios:
+                measure = getattr(benchmark, scenario)
+                for _ in range(warmup):
+                    measure()
+                runs = [measure() for _ in range(repeat)]
+                results[scenario] = _summarize(runs)
+                print(f"{scenario:<26} median {results[scenario]['median'] * 1000:9.1f} ms", file=sys.stderr)
+        finally:
+            if previous_cache_dir is None:
+                os.environ.pop("UV_CACHE_DIR", None)
+            else:
+                os.environ["UV_CACHE_DIR"] = previous_cache_dir
+    return results
+
+
+def format_table(results, baseline=None, threshold=0.10):
+    lines = []
+    header = f"{'scenario':<26} {'median ms':>10} {'min ms':>10} {'stdev ms':>10}"
+    if baseline:
+        header += f" {'base ms':>10} {'change':>8}"
+    lines.append(header)
+    for scenario, summary in results.items():
+        line = f"{scenario:<26} {summary['median'] * 1000:10.1f} {summary['min'] * 1000:10.1f} {summary['stdev'] * 1000:10.1f}"
+        base = (baseline or {}).get(scenario)
+        if base:
+            change = summary["median"] / base["median"] - 1
+            flag = "  slower" if change > threshold else "  faster" if change < -threshold else ""
+            line += f" {base['median'] * 1000:10.1f} {change:+8.1%}{flag}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TempVenv lifecycle offline.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--repeat", type=int, default=5, help="Measured runs per scenario.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured runs per scenario.")
+    parser.add_argument("--packages", type=int, default=16, help="Number of generated packages.")
+    parser.add_argument("--large-modules", type=int, default=2000, help="Modules in the package used by cleanup_large.")
+    parser.add_argument("--concurrent-envs", type=int, default=16, help="Environments built by the concurrent_* scenarios.")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change flagged as slower/faster.")
+    args = parser.parse_args(argv)
+
+    results = run(args.scenarios, args.repeat, args.warmup, args.packages, args.large_modules,
+                  min(args.concurrent_envs, args.packages))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print(format_table(results, baseline, args.threshold))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": _metadata(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+pytest plugin providing temporary virtual environment fixtures.
+
+Environments are built through a VenvCache in a directory shared by the whole
+test session, including every pytest-xdist worker, so an identical spec is
+built once per session and each test gets its own cheap clone of it.
+
+    def test_old_django(temp_venv):
+        python = temp_venv(packages=["django==3.2"])
+        subprocess.run([python, "-c", "import django"], check=True)
+"""
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+
+from temp_venv import TempVenv, VenvCache, _spec_key
+
+PLUGIN_NAME = "temp_venv_plugin"
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("temp_venv")
+    group.addoption(
+        "--temp-venv-cache",
+        default=None,
+        help="Directory of a VenvCache that keeps built environments across sessions. "
+             "Defaults to a directory in the session's base temporary directory.",
+    )
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(TempVenvPlugin(config), PLUGIN_NAME)
+
+
+class TempVenvPlugin:
+    """Builds environments for one pytest process and reports what the builds cost."""
+    def __init__(self, config):
+        self.config = config
+        self.records: List[Dict[str, Any]] = []
+
+    def enter(self, cache: VenvCache, packages=None, **kwargs) -> Tuple[TempVenv, str]:
+        if not {"cache", "pool", "template"} & kwargs.keys():
+            kwargs["cache"] = cache
+        kwargs.setdefault("cleanup", "background")
+        venv = TempVenv(packages=packages, **kwargs)
+        start = time.perf_counter()
+        python = venv.__enter__()
+        self.records.append({"reused": bool(venv.cache_hit), "seconds": time.perf_counter() - start})
+        return venv, python
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        # Runs on the xdist controller with what each worker sent back from pytest_sessionfinish.
+        self.records.extend(getattr(node, "workeroutput", {}).get("temp_venv_records", []))
+
+    def pytest_sessionfinish(self, session):
+        if hasattr(self.config, "workeroutput"):
+            self.config.workeroutput["temp_venv_records"] = self.records
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.records or hasattr(self.config, "workeroutput"):
+            return
+        built = [record["seconds"] for record in self.records if not record["reused"]]
+        reused = [record["seconds"] for record in self.records if record["reused"]]
+        terminalreporter.write_sep("-", "temp_venv summary")
+        terminalreporter.write_line(f"{len(self.records)} environments: {len(built)} built in {sum(built):.2f}s, "
+                                    f"{len(reused)} reused in {sum(reused):.2f}s")
+        if built and reused:
+            saved = len(reused) * sum(built) / len(built) - sum(reused)
+            terminalreporter.write_line(f"reuse saved about {saved:.2f}s")
+
+
+@pytest.fixture(scope="session")
+def temp_venv_cache(tmp_path_factory, pytestconfig) -> VenvCache:
+    """The VenvCache shared by every process of the test session."""
+    cache_dir = pytestconfig.getoption("temp_venv_cache")
+    if cache_dir is None:
+        base_dir = tmp_path_factory.getbasetemp()
+        if "PYTEST_XDIST_WORKER" in os.environ:
+            # Each xdist worker's base directory sits inside the one the whole session shares.
+            base_dir = base_dir.parent
+        cache_dir = base_dir / "temp_venv-cache"
+    return VenvCache(Path(cache_dir))
+
+
+@pytest.fixture
+def temp_venv(temp_venv_cache, pytestconfig) -> Callable[..., str]:
+    """
+    A factory that takes TempVenv arguments and returns the Python executable
+    of a fresh environment, private to the test and removed after it.
+    """
+    plugin = pytestconfig.pluginmanager.get_plugin(PLUGIN_NAME)
+    venvs = []
+
+    def factory(packages=None, **kwargs) -> str:
+        venv, python = plugin.enter(temp_venv_cache, packages, **kwargs)
+        venvs.append(venv)
+        return python
+
+    yield factory
+    for venv in reversed(venvs):
+        venv.__exit__(None, None, None)
+
+
+@pytest.fixture(scope="session")
+def temp_venv_session(temp_venv_cache, pytestconfig) -> Callable[..., str]:
+    """
+    Like temp_venv, but identical arguments return the same environment for
+    the rest of the session. Tests must not modify it.
+    """
+    plugin = pytestconfig.pluginmanager.get_plugin(PLUGIN_NAME)
+    venvs: Dict[str, Tuple[TempVenv, str]] = {}
+
+    def factory(packages=None, **kwargs) -> str:
+        key = _spec_key(dict(kwargs, packages=packages))
+        if key not in venvs:
+            venvs[key] = plugin.enter(temp_venv_cache, packages, **kwargs)
+        return venvs[key][1]
+
+    yield factory
+    for venv, _ in venvs.values():
+        venv.__exit__(None, None, None)
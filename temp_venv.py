@@ -1,10 +1,1495 @@
+import argparse
+import asyncio
+import atexit
+import codecs
+import collections
 import tempfile
 import subprocess
 import sys
 import os
+import re
 import shutil
+import contextlib
+import hashlib
+import json
+import time
+import uuid
 from pathlib import Path
-from typing import List, Optional
+import errno
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+def _venv_python_path(venv_root: Path) -> Path:
+    if os.name == "nt":
+        return venv_root / "Scripts" / "python.exe"
+    return venv_root / "bin" / "python"
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path: Path, blocking: bool = True, shared: bool = False) -> Iterator[bool]:
+    """
+    Holds an exclusive, inter-process lock on lock_path for the duration of the
+    with block, or a shared one if shared is True (exclusive on Windows, which
+    has no shared locks). Yields False instead of waiting if blocking is False
+    and the lock is already held elsewhere.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as lock_file:
+        try:
+            if os.name == "nt":
+                lock_file.seek(0)
+                mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+                msvcrt.locking(lock_file.fileno(), mode, 1)
+            else:
+                flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+                fcntl.flock(lock_file.fileno(), flags)
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _relocate_venv(venv_root: Path, old_root: Path, new_root: Optional[Path] = None) -> None:
+    """
+    Rewrites the absolute venv paths that uv embeds in activation scripts and
+    console-script shebangs of the environment at venv_root, replacing old_root
+    with new_root (venv_root itself by default). Files are replaced rather than
+    edited in place.
+    """
+    old_prefixes = {str(old_root), os.path.realpath(old_root)}
+    new_prefix = str(new_root if new_root is not None else venv_root).encode()
+    scripts_dir = _venv_python_path(venv_root).parent
+    candidates = [venv_root / "pyvenv.cfg"]
+    if scripts_dir.is_dir():
+        candidates.extend(scripts_dir.iterdir())
+    for path in candidates:
+        if path.is_symlink() or not path.is_file():
+            continue
+        data = path.read_bytes()
+        new_data = data
+        for old_prefix in old_prefixes:
+            new_data = new_data.replace(old_prefix.encode(), new_prefix)
+        if new_data == data:
+            continue
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        tmp_path.write_bytes(new_data)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only attempted on Linux")
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+
+def _clone_tree(src_root: Path, dst_root: Path, link_mode: str = "auto") -> None:
+    """
+    Clones the environment at src_root into dst_root (which may already exist)
+    and rewrites its embedded paths. Directories are always created fresh so a
+    clone can add and remove files freely. Package files are reflinked when the
+    filesystem supports it, otherwise hardlinked ("auto" or "hardlink") or
+    copied ("copy"); scripts and pyvenv.cfg are always copied because they are
+    rewritten. Hardlinks are only safe because _freeze_packages() made the
+    shared files read-only, which root ignores, so "auto" copies instead of
+    hardlinking when running as root.
+    """
+    if link_mode not in ("auto", "reflink", "hardlink", "copy"):
+        raise ValueError(f"Unknown link_mode: {link_mode!r}")
+    if os.name == "nt" and link_mode == "auto":
+        link_mode = "copy"
+    try_reflink = link_mode in ("auto", "reflink")
+    running_as_root = hasattr(os, "geteuid") and os.geteuid() == 0
+    try_hardlink = link_mode == "hardlink" or (link_mode == "auto" and not running_as_root)
+    private_dirs = {os.path.normpath(src_root), os.path.normpath(_venv_python_path(src_root).parent)}
+    for dirpath, dirnames, filenames in os.walk(src_root):
+        rel_dir = os.path.relpath(dirpath, src_root)
+        target_dir = os.path.normpath(os.path.join(dst_root, rel_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        shareable = os.path.normpath(dirpath) not in private_dirs
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                if name in dirnames:
+                    dirnames.remove(name)
+                continue
+            if name in dirnames:
+                continue
+            if name == VenvCache.ENTRY_MARKER:
+                continue
+            if shareable and try_reflink:
+                try:
+                    _reflink(src, dst)
+                    continue
+                except OSError:
+                    try_reflink = False
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(dst)
+            if shareable and try_hardlink:
+                try:
+                    os.link(src, dst)
+                    continue
+                except OSError:
+                    # Typically EXDEV: the source is on another filesystem.
+                    try_hardlink = False
+            shutil.copy2(src, dst)
+    _relocate_venv(dst_root, src_root)
+
+
+def _freeze_packages(venv_root: Path) -> None:
+    """
+    Removes write permission from installed package files so that a clone that
+    shares them through hardlinks cannot modify them in place. Directories stay
+    writable, so installers can still replace or remove the files in a clone.
+    """
+    if os.name == "nt":
+        return
+    private_dirs = {os.path.normpath(venv_root), os.path.normpath(_venv_python_path(venv_root).parent)}
+    write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    for dirpath, _, filenames in os.walk(venv_root):
+        if os.path.normpath(dirpath) in private_dirs:
+            continue
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.islink(path):
+                continue
+            mode = os.lstat(path).st_mode
+            os.chmod(path, mode & ~write_bits)
+
+
+def _tree_size(root: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+_TRASH_DIR_NAME = "temp_venv-trash"
+_OWNED_DIR = re.compile(r"temp_venv-(\d+)-")
+
+
+def _temp_dir_prefix(kind: str = "") -> str:
+    # The owning PID in the name lets sweep_orphans() tell abandoned directories from live ones.
+    return f"temp_venv-{os.getpid()}-{kind}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED: exists, owned by someone else
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Reaper:
+    """Deletes directory trees on a daemon thread, one at a time."""
+    def __init__(self):
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, path: str) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="temp_venv-reaper", daemon=True)
+                self._thread.start()
+        self._queue.put(path)
+
+    def _run(self) -> None:
+        while True:
+            path = self._queue.get()
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                self._queue.task_done()
+
+    def drain(self) -> None:
+        self._queue.join()
+
+
+_reaper = _Reaper()
+# Finish pending deletions before the interpreter exits; anything a killed process leaves in the trash is swept later.
+atexit.register(_reaper.drain)
+
+
+def _remove_in_background(temp_dir: tempfile.TemporaryDirectory) -> None:
+    path = Path(temp_dir.name)
+    trash = path.parent / _TRASH_DIR_NAME
+    target = trash / f"{path.name}-{uuid.uuid4().hex[:8]}"
+    try:
+        trash.mkdir(exist_ok=True)
+        os.rename(path, target)
+    except OSError:
+        temp_dir.cleanup()
+        return
+    # The TemporaryDirectory still owns its path; give it an empty one to remove.
+    path.mkdir()
+    temp_dir.cleanup()
+    _reaper.submit(str(target))
+
+
+def _private_dir(path: Path) -> Path:
+    """
+    Creates path (mode 0700) if needed and returns it. Raises RuntimeError if
+    it belongs to another user or others can write to it, since its contents
+    end up in environments and could have been planted there.
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if hasattr(os, "getuid"):
+        info = path.stat()
+        if info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise RuntimeError(f"Refusing to use {path}: it is not a private directory of the current user.")
+    return path
+
+
+def _per_user_temp_dir(name: str) -> Path:
+    # The system temp directory is shared, so include the user ID in the name.
+    suffix = f"-{os.getuid()}" if hasattr(os, "getuid") else ""
+    return Path(tempfile.gettempdir()) / f"{name}{suffix}"
+
+
+def sweep_orphans(temp_root: Optional[Union[str, Path]] = None) -> List[Path]:
+    """
+    Removes temporary environments, templates and pending background deletions
+    left behind by processes that no longer exist, such as test runs that were
+    killed before their with blocks exited.
+
+    Directories are matched to their owner by the process ID in their name, so
+    only sweep a temp_root that is not shared with other machines or
+    containers, whose process IDs cannot be checked from here.
+
+    Args:
+        temp_root: The directory to sweep. Defaults to tempfile.gettempdir().
+
+    Returns:
+        The directories that were removed.
+    """
+    root = Path(temp_root) if temp_root is not None else Path(tempfile.gettempdir())
+    removed = []
+    for parent in (root, root / _TRASH_DIR_NAME):
+        try:
+            entries = list(os.scandir(parent))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            match = _OWNED_DIR.match(entry.name)
+            if match is None or not entry.is_dir(follow_symlinks=False) or _pid_alive(int(match.group(1))):
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            if not os.path.lexists(entry.path):
+                removed.append(Path(entry.path))
+    return removed
+
+
+class _OutputStream:
+    """
+    Splits a subprocess stream into lines as it arrives, passes each line to
+    on_line and keeps only the last max_lines of them, or all if max_lines is None.
+    Older lines matching keep (at most max_lines of them) are kept as well.
+    """
+    def __init__(self, on_line: Optional[Callable[[str], None]], max_lines: Optional[int], keep: Optional["re.Pattern[str]"] = None):
+        self._on_line = on_line
+        self._lines: "collections.deque[str]" = collections.deque(maxlen=max_lines)
+        self._keep = keep
+        self._kept: List[str] = []
+        self._partial = ""
+        self.dropped = 0
+        self.error: Optional[BaseException] = None
+
+    def write(self, text: str) -> None:
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._add(line)
+
+    def close(self) -> None:
+        if self._partial:
+            self._add(self._partial)
+            self._partial = ""
+
+    def _add(self, line: str) -> None:
+        line = line.rstrip("\r")
+        if self._lines.maxlen is not None and len(self._lines) == self._lines.maxlen:
+            oldest = self._lines[0]
+            if self._keep is not None and len(self._kept) < self._lines.maxlen and self._keep.search(oldest):
+                self._kept.append(oldest)
+            else:
+                self.dropped += 1
+        self._lines.append(line)
+        if self._on_line is not None:
+            try:
+                self._on_line(line)
+            except Exception as e:
+                # Keep draining the pipe so the process cannot block; the error is raised once it exits.
+                self._on_line = None
+                self.error = e
+
+    def pump(self, pipe) -> None:
+        for text in pipe:
+            self.write(text)
+        self.close()
+
+    async def pump_async(self, reader: asyncio.StreamReader) -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            self.write(decoder.decode(chunk))
+        self.write(decoder.decode(b"", final=True))
+        self.close()
+
+    def text(self) -> str:
+        lines = list(self._lines)
+        if self.dropped:
+            lines.insert(0, f"[{self.dropped} earlier lines omitted]")
+        lines[:0] = self._kept
+        return "".join(line + "\n" for line in lines)
+
+
+class VenvCache:
+    """
+    A persistent, content-addressed store of fully built virtual environments.
+
+    Entries are keyed by a hash of everything that determines the contents of
+    an environment: the interpreter version, the normalized package list, the
+    requirements file contents, pip_options and venv_options. Entries are
+    evicted once they exceed max_age seconds, and least recently used entries
+    are evicted while the cache is larger than max_size bytes. File locks make
+    the cache safe to share between concurrent processes.
+    """
+    ENTRY_MARKER = ".temp-venv-cache.json"
+
+    def __init__(self, cache_dir: Union[str, Path], max_size: Optional[int] = None, max_age: Optional[float] = None):
+        """
+        Initializes the cache.
+
+        Args:
+            cache_dir: Directory holding the cached environments.
+            max_size: Maximum total size of the cache in bytes.
+            max_age: Maximum age of a cached environment in seconds.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.envs_dir = self.cache_dir / "envs"
+        self.locks_dir = self.cache_dir / "locks"
+        self.staging_dir = self.cache_dir / "staging"
+
+    @staticmethod
+    def make_key(interpreter_version: str, packages: List[str], requirements_text: Optional[str], pip_options: List[str], venv_options: List[str]) -> str:
+        normalized_packages = sorted({"".join(package.split()) for package in packages})
+        material = json.dumps({
+            "interpreter": interpreter_version,
+            "packages": normalized_packages,
+            "requirements": requirements_text,
+            "pip_options": list(pip_options),
+            "venv_options": list(venv_options),
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.envs_dir / key
+
+    def lock(self, key: str, blocking: bool = True, shared: bool = False):
+        """
+        Locks the entry for key. Hold it exclusively to build or store the
+        entry, and shared to clone from an existing one.
+        """
+        return _file_lock(self.locks_dir / f"{key}.lock", blocking=blocking, shared=shared)
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        Returns the cached environment for key, or None. Call with the key's
+        lock held; a shared lock is enough. Expired entries are not returned,
+        and are replaced by the next store().
+        """
+        entry = self.entry_path(key)
+        marker = entry / self.ENTRY_MARKER
+        if not marker.is_file():
+            return None
+        if self.max_age is not None and time.time() - self._read_marker(marker).get("created", 0) > self.max_age:
+            return None
+        os.utime(marker)
+        return entry
+
+    def store(self, key: str, venv_root: Path) -> Path:
+        """Copies a built environment into the cache. Call with the key's lock held exclusively."""
+        entry = self.entry_path(key)
+        if self.lookup(key) is not None:
+            return entry
+        self.envs_dir.mkdir(parents=True, exist_ok=True)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.staging_dir / f"{key}.{os.getpid()}.{uuid.uuid4().hex}"
+        shutil.copytree(venv_root, staging, symlinks=True)
+        _relocate_venv(staging, venv_root, new_root=entry)
+        _freeze_packages(staging)
+        if entry.exists():
+            self._remove_entry(entry)
+        os.rename(staging, entry)
+        marker = {"key": key, "created": time.time(), "size": _tree_size(entry)}
+        (entry / self.ENTRY_MARKER).write_text(json.dumps(marker))
+        return entry
+
+    def entries(self) -> List[dict]:
+        if not self.envs_dir.is_dir():
+            return []
+        result = []
+        for entry in self.envs_dir.iterdir():
+            marker = entry / self.ENTRY_MARKER
+            if not marker.is_file():
+                continue
+            info = self._read_marker(marker)
+            info["path"] = str(entry)
+            info["last_used"] = marker.stat().st_mtime
+            result.append(info)
+        return result
+
+    def evict(self) -> List[str]:
+        """Removes expired and least recently used entries. Entries in use are skipped."""
+        evicted = []
+        with _file_lock(self.cache_dir / "evict.lock"):
+            entries = sorted(self.entries(), key=lambda info: info["last_used"])
+            total_size = sum(info.get("size", 0) for info in entries)
+            now = time.time()
+            for info in entries:
+                expired = self.max_age is not None and now - info.get("created", 0) > self.max_age
+                oversized = self.max_size is not None and total_size > self.max_size
+                if not (expired or oversized):
+                    continue
+                with self.lock(info["key"], blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    self._remove_entry(Path(info["path"]))
+                total_size -= info.get("size", 0)
+                evicted.append(info["key"])
+        return evicted
+
+    def clear(self) -> None:
+        for info in self.entries():
+            with self.lock(info["key"]):
+                self._remove_entry(Path(info["path"]))
+
+    @staticmethod
+    def _read_marker(marker: Path) -> dict:
+        try:
+            return json.loads(marker.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _remove_entry(self, entry: Path) -> None:
+        # Removing the marker first makes a half-deleted entry count as a miss.
+        with contextlib.suppress(FileNotFoundError):
+            (entry / self.ENTRY_MARKER).unlink()
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+class PackageStore:
+    """
+    A shared store of unpacked distributions that environments link their
+    package files from, instead of each extracting its own copy of a wheel.
+
+    The store is a uv cache directory owned by this library: uv unpacks every
+    wheel once into it, keyed by name, version and tags, and installs into an
+    environment by linking those files. Environments that use the store are
+    registered while they exist, and gc() only prunes the store when none are
+    alive. Hardlinks and reflinks cannot cross filesystems, so environments on
+    another filesystem than the store get copies instead.
+    """
+    LINK_MODES = ("hardlink", "symlink", "clone", "copy")
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, link_mode: str = "hardlink"):
+        """
+        Args:
+            path: Directory of the store. Defaults to a directory of the
+                current user next to the temporary environments, so hardlinks
+                work; one that another user owns or can write to is refused.
+            link_mode: How installed files refer to the store: "hardlink",
+                "symlink", "clone" (reflink) or "copy". Symlinked environments
+                break if the store is cleared while they exist.
+        """
+        if link_mode not in self.LINK_MODES:
+            raise ValueError(f"Unknown link mode: {link_mode!r}")
+        self.path = Path(path) if path is not None else _private_dir(_per_user_temp_dir("temp_venv-store"))
+        self.link_mode = link_mode
+        self.cache_dir = self.path / "uv"
+        self.refs_dir = self.path / "refs"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.refs_dir.mkdir(parents=True, exist_ok=True)
+        self._gc_lock = self.path / "gc.lock"
+
+    def link_mode_for(self, target: Union[str, Path]) -> str:
+        """Returns the link mode that works for an environment at target."""
+        if self.link_mode in ("hardlink", "clone"):
+            try:
+                same_filesystem = os.stat(self.cache_dir).st_dev == os.stat(target).st_dev
+            except OSError:
+                same_filesystem = False
+            if not same_filesystem:
+                return "copy"
+        return self.link_mode
+
+    def uv_env(self, target: Union[str, Path]) -> Dict[str, str]:
+        """Returns the environment variables that make uv install into target from the store."""
+        return {"UV_CACHE_DIR": str(self.cache_dir), "UV_LINK_MODE": self.link_mode_for(target)}
+
+    def register(self, venv_root: Union[str, Path]) -> Path:
+        """Records that venv_root uses the store and returns the reference to release()."""
+        with _file_lock(self._gc_lock):
+            ref = self.refs_dir / f"{os.getpid()}-{uuid.uuid4().hex}.json"
+            ref.write_text(json.dumps({"pid": os.getpid(), "path": str(venv_root)}))
+        return ref
+
+    def release(self, ref: Path) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            ref.unlink()
+
+    def references(self) -> List[str]:
+        """
+        Returns the environments currently using the store. References of
+        processes that died, or environments that no longer exist, are removed.
+        """
+        live = []
+        for ref in sorted(self.refs_dir.glob("*.json")):
+            try:
+                data = json.loads(ref.read_text())
+            except (OSError, ValueError):
+                continue
+            if _pid_alive(data["pid"]) and os.path.exists(data["path"]):
+                live.append(data["path"])
+            else:
+                self.release(ref)
+        return live
+
+    def gc(self, full: bool = False) -> bool:
+        """
+        Prunes unused entries from the store, or empties it if full is True,
+        but only while no environment is using it.
+
+        Returns:
+            True if the store was collected, False if it is in use.
+        """
+        with _file_lock(self._gc_lock):
+            if self.references():
+                return False
+            subprocess.run([sys.executable, "-m", "uv", "cache", "clean" if full else "prune", "--cache-dir", str(self.cache_dir)],
+                           check=True, capture_output=True, text=True)
+        return True
+
+
+class TempVenvPool:
+    """
+    Keeps pristine, already-created virtual environments ready for TempVenv.
+
+    Environments are grouped by (python_executable, venv_options). Each group
+    that has been asked for is kept topped up to `size` idle environments by a
+    background thread, so a TempVenv using the pool skips interpreter discovery
+    and `uv venv` on enter. Use the pool as a context manager, or call close(),
+    to stop the thread and remove the idle environments.
+    """
+    def __init__(self, size: int = 2, reset_on_release: bool = False, verbose: bool = False):
+        """
+        Initializes the pool.
+
+        Args:
+            size: Number of idle environments to keep per key.
+            reset_on_release: If True, environments released by TempVenv are
+                reset to their pristine package set and returned to the pool.
+                If False, they are discarded.
+            verbose: If True, print detailed logs.
+        """
+        self.size = size
+        self.reset_on_release = reset_on_release
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        self.last_error: Optional[BaseException] = None
+        self._idle: Dict[Tuple, List[tempfile.TemporaryDirectory]] = {}
+        self._wanted: List[Tuple] = []
+        self._base_pythons: Dict[Tuple, str] = {}
+        self._pristine_requirements: Dict[Tuple, str] = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def make_key(python_executable: Optional[str], venv_options: Optional[List[str]]) -> Tuple:
+        return (python_executable, tuple(venv_options or []))
+
+    def _builder(self, key: Tuple) -> "TempVenv":
+        return TempVenv(python_executable=key[0], venv_options=list(key[1]), verbose=self.verbose)
+
+    def _base_python(self, key: Tuple) -> str:
+        if key not in self._base_pythons:
+            self._base_pythons[key] = self._builder(key)._find_python_executable()
+        return self._base_pythons[key]
+
+    def _create(self, key: Tuple) -> tempfile.TemporaryDirectory:
+        base_python = self._base_python(key)
+        builder = self._builder(key)
+        temp_dir = tempfile.TemporaryDirectory(prefix=_temp_dir_prefix())
+        try:
+            builder._create_venv(Path(temp_dir.name), base_python)
+            if key not in self._pristine_requirements:
+                cmd = ["uv", "pip", "freeze", "--python", str(builder.venv_python_executable)]
+                freeze = builder._run_subprocess(cmd, "uv recording pristine packages", python_executable_for_module=base_python, keep_output=True)
+                self._pristine_requirements[key] = freeze.stdout
+        except BaseException:
+            temp_dir.cleanup()
+            raise
+        return temp_dir
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name="TempVenvPool-refill", daemon=True)
+            self._thread.start()
+
+    def _next_deficit(self) -> Optional[Tuple]:
+        for key in self._wanted:
+            if len(self._idle.get(key, [])) < self.size:
+                return key
+        return None
+
+    def _refill_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and self._next_deficit() is None:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                key = self._next_deficit()
+            try:
+                temp_dir = self._create(key)
+            except Exception as e:
+                # Stop refilling a key that cannot be built; acquire() re-registers it.
+                self.last_error = e
+                if self.verbose:
+                    print(f"Pool failed to create environment for {key}: {e}")
+                with self._condition:
+                    if key in self._wanted:
+                        self._wanted.remove(key)
+                continue
+            with self._condition:
+                if self._closed:
+                    temp_dir.cleanup()
+                    return
+                self._idle.setdefault(key, []).append(temp_dir)
+                self._condition.notify_all()
+
+    def warm(self, python_executable: Optional[str] = None, venv_options: Optional[List[str]] = None) -> None:
+        """Starts keeping environments ready for the given key without taking one."""
+        key = self.make_key(python_executable, venv_options)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("TempVenvPool is closed.")
+            if key not in self._wanted:
+                self._wanted.append(key)
+            self._ensure_thread()
+            self._condition.notify_all()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every warmed key has `size` idle environments. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._closed or self._next_deficit() is None, timeout)
+
+    def acquire(self, python_executable: Optional[str] = None, venv_options: Optional[List[str]] = None) -> Tuple[tempfile.TemporaryDirectory, str]:
+        """
+        Takes an environment from the pool, creating one if none is idle.
+
+        Returns:
+            The environment's TemporaryDirectory and the base Python it was created with.
+        """
+        key = self.make_key(python_executable, venv_options)
+        self.warm(python_executable, venv_options)
+        with self._condition:
+            idle = self._idle.get(key)
+            temp_dir = idle.pop() if idle else None
+            if temp_dir is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._condition.notify_all()
+        if temp_dir is None:
+            if self.verbose:
+                print(f"Pool miss for {key}: creating environment on demand")
+            temp_dir = self._create(key)
+        elif self.verbose:
+            print(f"Pool hit for {key}: using {temp_dir.name}")
+        return temp_dir, self._base_python(key)
+
+    def release(self, temp_dir: tempfile.TemporaryDirectory, python_executable: Optional[str] = None, venv_options: Optional[List[str]] = None) -> None:
+        """Discards an environment taken with acquire(), or resets it and returns it to the pool."""
+        key = self.make_key(python_executable, venv_options)
+        if self.reset_on_release and not self._closed:
+            try:
+                self._reset(key, Path(temp_dir.name))
+            except Exception as e:
+                if self.verbose:
+                    print(f"Pool could not reset {temp_dir.name}, discarding it: {e}")
+            else:
+                with self._condition:
+                    if not self._closed:
+                        # Prefer the reset environment over surplus ones from the refill thread.
+                        idle = self._idle.setdefault(key, [])
+                        idle.append(temp_dir)
+                        surplus = idle[:-self.size] if self.size > 0 else idle[:]
+                        del idle[:len(surplus)]
+                        for extra in surplus:
+                            extra.cleanup()
+                        return
+        temp_dir.cleanup()
+
+    def _reset(self, key: Tuple, venv_root: Path) -> None:
+        builder = self._builder(key)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as requirements:
+            requirements.write(self._pristine_requirements.get(key, ""))
+        try:
+            cmd = ["uv", "pip", "sync", "--allow-empty-requirements", requirements.name, "--python", str(_venv_python_path(venv_root))]
+            builder._run_subprocess(cmd, "uv resetting pooled environment", python_executable_for_module=self._base_python(key))
+        finally:
+            os.remove(requirements.name)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "idle": {key: len(envs) for key, envs in self._idle.items()},
+            }
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        with self._condition:
+            for envs in self._idle.values():
+                for temp_dir in envs:
+                    temp_dir.cleanup()
+            self._idle.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class VenvTemplate:
+    """
+    A base environment that is built once and then cloned into TempVenv
+    instances, which install only their own extra packages on top.
+
+    Clones share package files with the template through reflinks or read-only
+    hardlinks, so creating one costs roughly a directory-tree walk. Installing
+    into or writing to a clone never modifies the template: processes running
+    as root, which can write through read-only hardlinks, get copies unless
+    they ask for link_mode="hardlink". Use the template as a context manager,
+    or call remove(), to delete it.
+    """
+    def __init__(
+        self,
+        packages: Optional[List[str]] = None,
+        python_executable: Optional[str] = None,
+        pip_options: Optional[List[str]] = None,
+        venv_options: Optional[List[str]] = None,
+        requirements_file: Optional[str] = None,
+        path: Optional[str] = None,
+        verbose: bool = False,
+    ):
+        """
+        Initializes the template. Nothing is built until build() or the first clone.
+
+        Args:
+            packages: A list of strings specifying the base packages.
+            python_executable: Path to the Python executable for the venv.
+            pip_options: Additional options for pip install commands.
+            venv_options: Additional options for venv creation.
+            requirements_file: Path to a requirements.txt file.
+            path: Directory to build the template in. A temporary directory is
+                used if None.
+            verbose: If True, print detailed logs.
+        """
+        self.builder = TempVenv(
+            packages=packages,
+            python_executable=python_executable,
+            pip_options=pip_options,
+            venv_options=venv_options,
+            requirements_file=requirements_file,
+            verbose=verbose,
+        )
+        self.path = Path(path) if path else None
+        self._owns_path = path is None
+        self.base_python: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def build(self) -> Path:
+        """Builds the template if it has not been built yet and returns its path."""
+        with self._lock:
+            if self.base_python is not None:
+                return self.path
+            if self.path is None:
+                self.path = Path(tempfile.mkdtemp(prefix=_temp_dir_prefix("template-")))
+            with self.builder._setup_errors():
+                base_python = self.builder._find_python_executable()
+                self.builder._build_venv(self.path, base_python)
+                _freeze_packages(self.path)
+            self.base_python = base_python
+            return self.path
+
+    def clone_into(self, target: Path, link_mode: str = "auto") -> None:
+        _clone_tree(self.build(), Path(target), link_mode)
+
+    def remove(self) -> None:
+        with self._lock:
+            if self.path is not None and self._owns_path:
+                shutil.rmtree(self.path, ignore_errors=True)
+                self.path = None
+            self.base_python = None
+
+    def __enter__(self):
+        self.build()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.remove()
+
+
+class BatchResult(NamedTuple):
+    """
+    The outcome of building one spec with TempVenv.create_many().
+
+    On success venv is the entered TempVenv and python its interpreter path;
+    call close() when done with it. On failure venv and python are None and
+    error holds the exception. count is the number of identical input specs
+    this build served, and elapsed the build time in seconds.
+    """
+    spec: Dict[str, Any]
+    venv: Optional["TempVenv"]
+    python: Optional[str]
+    elapsed: float
+    error: Optional[Exception]
+    count: int = 1
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def close(self) -> None:
+        if self.venv is not None:
+            self.venv.__exit__(None, None, None)
+
+
+def _canonical_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _requirement_name(requirement: str) -> Optional[str]:
+    """Returns the canonical project name of a requirement line, or None for options, paths and URLs."""
+    requirement = requirement.split("#", 1)[0].strip()
+    if not requirement or requirement.startswith("-"):
+        return None
+    match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[|\(|@|;|[<>=!~]|$)", requirement)
+    return _canonical_name(match.group(1)) if match else None
+
+
+class Wheelhouse:
+    """
+    A local directory of distributions that TempVenv installs from with no
+    network access. Fill it once with prefetch() on a machine that has network
+    access, then pass it as TempVenv(wheelhouse=...).
+    """
+    ARTIFACT_SUFFIXES = (".whl", ".tar.gz", ".zip")
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Initializes the wheelhouse.
+
+        Args:
+            path: Directory holding the distributions. Created on prefetch.
+        """
+        self.path = Path(path)
+
+    def pip_options(self) -> List[str]:
+        return ["--no-index", "--find-links", str(self.path)]
+
+    def artifacts(self) -> List[Path]:
+        if not self.path.is_dir():
+            return []
+        return sorted(p for p in self.path.iterdir() if p.name.endswith(self.ARTIFACT_SUFFIXES))
+
+    def project_names(self) -> set:
+        names = set()
+        for artifact in self.artifacts():
+            if artifact.suffix == ".whl":
+                names.add(_canonical_name(artifact.name.split("-", 1)[0]))
+            else:
+                stem = artifact.name[:-len(".tar.gz")] if artifact.name.endswith(".tar.gz") else artifact.stem
+                names.add(_canonical_name(stem.rsplit("-", 1)[0]))
+        return names
+
+    def missing(self, packages: Optional[List[str]] = None, requirements_file: Optional[str] = None) -> List[str]:
+        """Returns the requested projects that have no artifact in the wheelhouse."""
+        requirements = list(packages or [])
+        if requirements_file and Path(requirements_file).is_file():
+            requirements.extend(Path(requirements_file).read_text().splitlines())
+        available = self.project_names()
+        missing = []
+        for requirement in requirements:
+            name = _requirement_name(requirement)
+            if name and name not in available and name not in missing:
+                missing.append(name)
+        return missing
+
+    @staticmethod
+    def missing_from_error(stderr: Optional[str]) -> List[str]:
+        """Extracts the projects uv reported as unavailable from its error output."""
+        if not stderr:
+            return []
+        names = re.findall(r"Because (\S+) was not found in the (?:provided package locations|package registry)", stderr)
+        return list(dict.fromkeys(_canonical_name(name) for name in names))
+
+    def prefetch(self, packages: Optional[List[str]] = None, requirements_file: Optional[str] = None, python_executable: Optional[str] = None, pip_options: Optional[List[str]] = None, verbose: bool = False) -> List[Path]:
+        """
+        Downloads distributions for the given packages and all of their
+        dependencies into the wheelhouse, for the given interpreter.
+
+        Args:
+            packages: A list of strings specifying packages to fetch.
+            requirements_file: Path to a requirements.txt file to fetch.
+            python_executable: The interpreter the distributions must suit.
+            pip_options: Additional options for pip download.
+            verbose: If True, print detailed logs.
+
+        Returns:
+            The artifacts in the wheelhouse afterwards.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        # uv has no download command, so use pip from a throwaway seeded environment.
+        downloader = TempVenv(python_executable=python_executable, venv_options=["--seed"], verbose=verbose)
+        with downloader as venv_python:
+            cmd = [venv_python, "-m", "pip", "download", "--disable-pip-version-check", "--prefer-binary", "-d", str(self.path)]
+            cmd += list(pip_options or [])
+            if requirements_file:
+                cmd += ["-r", requirements_file]
+            cmd += list(packages or [])
+            with downloader._setup_errors():
+                downloader._run_subprocess(cmd, "pip downloading into wheelhouse")
+        return self.artifacts()
+
+
+_PROBE_SCRIPT = (
+    "import json, sys, sysconfig; print(json.dumps({"
+    "'version': list(sys.version_info[:3]), 'version_string': sys.version, "
+    "'implementation': sys.implementation.name, "
+    "'abi': sysconfig.get_config_var('SOABI') or sys.implementation.cache_tag, "
+    "'platform': sysconfig.get_platform(), 'sys_executable': sys.executable}))"
+)
+
+
+class InterpreterInfo(NamedTuple):
+    """What an InterpreterRegistry learned by running a Python executable once."""
+    executable: str
+    version: Tuple[int, ...]
+    version_string: str
+    implementation: str
+    abi: str
+    platform: str
+    sys_executable: str
+    stamp: Tuple[str, int, int, int]
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.implementation} {self.version_string} {self.abi} {self.platform}"
+
+
+def _parse_version(text: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in text.split("."))
+
+
+def version_matches(version: Tuple[int, ...], spec: str) -> bool:
+    """
+    Checks an interpreter version against a comma-separated spec such as
+    ">=3.10,<3.13" or "3.11". Operators are ==, !=, >=, <=, >, < and ~=; a
+    bare version means ==. With == and != a version with fewer components,
+    or ending in ".*", matches as a prefix, so "==3.11" accepts 3.11.7.
+    """
+    for clause in spec.split(","):
+        clause = clause.strip()
+        if not clause:
+            continue
+        match = re.match(r"^(==|!=|>=|<=|~=|>|<)?\s*(\d+(?:\.\d+)*)(\.\*)?$", clause)
+        if not match:
+            raise ValueError(f"Invalid Python version spec: {clause!r}")
+        operator, target_text, _ = match.groups()
+        operator = operator or "=="
+        target = _parse_version(target_text)
+        if operator in ("==", "!="):
+            equal = tuple(version[:len(target)]) == target
+            if equal != (operator == "=="):
+                return False
+            continue
+        padded = tuple(version[:len(target)]) + (0,) * (len(target) - len(version))
+        if operator == "~=":
+            if len(target) < 2 or padded < target or tuple(version[:len(target) - 1]) != target[:-1]:
+                return False
+        elif not {">=": padded >= target, "<=": padded <= target, ">": padded > target, "<": padded < target}[operator]:
+            return False
+    return True
+
+
+class InterpreterRegistry:
+    """
+    Probes Python executables once and shares what it learned across all
+    TempVenv instances. An entry is reused until the executable's resolved
+    path, mtime, inode or size changes. Entries can also be persisted to a
+    JSON file, which makes them survive across processes.
+    """
+    def __init__(self, path: Optional[Union[str, Path]] = None, timeout: float = 30):
+        """
+        Initializes the registry.
+
+        Args:
+            path: Optional JSON file to load entries from and save them to.
+            timeout: Maximum number of seconds a probe may run.
+        """
+        self.path = Path(path) if path else None
+        self.timeout = timeout
+        self.probes = 0
+        self._entries: Dict[str, InterpreterInfo] = {}
+        self._lock = threading.Lock()
+        if self.path is not None and self.path.is_file():
+            self._entries.update(self._load())
+
+    def _load(self) -> Dict[str, InterpreterInfo]:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        entries = {}
+        for key, fields in data.items():
+            try:
+                fields["version"] = tuple(fields["version"])
+                fields["stamp"] = tuple(fields["stamp"])
+                entries[key] = InterpreterInfo(**fields)
+            except (TypeError, KeyError):
+                continue
+        return entries
+
+    def _save(self) -> None:
+        with _file_lock(self.path.with_name(self.path.name + ".lock")):
+            entries = self._load() if self.path.is_file() else {}
+            entries.update(self._entries)
+            tmp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+            tmp_path.write_text(json.dumps({key: info._asdict() for key, info in entries.items()}, indent=1))
+            os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _stamp(executable_path: str) -> Tuple[str, int, int, int]:
+        real_path = os.path.realpath(executable_path)
+        st = os.stat(real_path)
+        return (real_path, st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def probe(self, executable: str) -> InterpreterInfo:
+        """
+        Returns information about executable, running it only if it has not
+        been probed before or has changed since.
+
+        Raises:
+            FileNotFoundError: If executable cannot be found.
+            subprocess.CalledProcessError: If the probe fails.
+        """
+        executable_path = shutil.which(executable) or executable
+        if not os.path.isfile(executable_path):
+            raise FileNotFoundError(f"Python executable not found: {executable}")
+        key = os.path.abspath(executable_path)
+        stamp = self._stamp(key)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached.stamp == stamp:
+                return cached
+        process = subprocess.run([key, "-c", _PROBE_SCRIPT], check=True, capture_output=True, text=True, timeout=self.timeout)
+        fields = json.loads(process.stdout)
+        info = InterpreterInfo(executable=key, version=tuple(fields["version"]), version_string=fields["version_string"],
+                               implementation=fields["implementation"], abi=fields["abi"], platform=fields["platform"],
+                               sys_executable=fields["sys_executable"], stamp=stamp)
+        with self._lock:
+            self.probes += 1
+            self._entries[key] = info
+            if self.path is not None:
+                self._save()
+        return info
+
+    @staticmethod
+    def candidates() -> List[str]:
+        """Python executables worth trying, most preferred first."""
+        names = [sys.executable, "python3", "python"]
+        names += [f"python3.{minor}" for minor in range(20, 7, -1)]
+        if os.name == "nt":
+            names.append("py")
+        seen = set()
+        result = []
+        for name in names:
+            path = shutil.which(name) if name else None
+            if path and os.path.realpath(path) not in seen:
+                seen.add(os.path.realpath(path))
+                result.append(path)
+        return result
+
+    def find(self, version_spec: Optional[str] = None, candidates: Optional[List[str]] = None) -> InterpreterInfo:
+        """
+        Returns the newest interpreter matching version_spec (any, if None).
+        Only candidates that were never probed, or have changed, are run.
+
+        Raises:
+            RuntimeError: If no candidate matches.
+        """
+        best = None
+        for candidate in candidates if candidates is not None else self.candidates():
+            try:
+                info = self.probe(candidate)
+            except (OSError, ValueError, subprocess.SubprocessError):
+                continue
+            if version_spec and not version_matches(info.version, version_spec):
+                continue
+            if best is None or info.version > best.version:
+                best = info
+        if best is None:
+            raise RuntimeError(f"Could not find a Python executable matching {version_spec!r}.")
+        return best
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+default_registry = InterpreterRegistry()
+
+
+def _spec_key(spec: Dict[str, Any]) -> str:
+    normalized = dict(spec)
+    if normalized.get("packages"):
+        normalized["packages"] = sorted("".join(package.split()) for package in normalized["packages"])
+    return json.dumps(normalized, sort_keys=True, default=repr)
+
+
+_SPEC_PATH_KEYS = ("requirements_file", "lock_file", "wheelhouse")
+
+
+def _absolute_spec_paths(spec: Dict[str, Any]) -> Dict[str, Any]:
+    resolved = dict(spec)
+    for key in _SPEC_PATH_KEYS:
+        if resolved.get(key):
+            resolved[key] = os.path.abspath(resolved[key])
+    return resolved
+
+
+_WORKER_SOURCE = r"""
+import contextlib, importlib, io, json, os, sys, traceback
+
+# Keep private copies of the pipes for the protocol, so code that prints or
+# reads stdin (including C extensions and subprocesses) cannot corrupt it.
+requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+responses = os.fdopen(os.dup(1), "w", encoding="utf-8")
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(devnull, 0)
+os.dup2(2, 1)
+namespace = {"__name__": "__temp_venv_worker__"}
+
+for line in requests:
+    request = json.loads(line)
+    captured = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(captured):
+            if request["op"] == "run":
+                exec(compile(request["code"], "<temp_venv worker>", "exec"), namespace)
+                result = None
+            else:
+                target = importlib.import_module(request["module"])
+                for attribute in request["func"].split("."):
+                    target = getattr(target, attribute)
+                result = target(*request["args"], **request["kwargs"])
+        response = json.dumps({"ok": True, "result": result, "stdout": captured.getvalue()})
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        response = json.dumps({"ok": False, "error": type(e).__name__, "message": str(e),
+                               "traceback": traceback.format_exc(), "stdout": captured.getvalue()})
+    responses.write(response + "\n")
+    responses.flush()
+"""
+
+
+class VenvWorker:
+    """
+    A long-lived Python process inside a virtual environment that runs code
+    sent to it over a pipe. Interpreter startup and imports are paid once,
+    so repeated calls are much cheaper than one subprocess per call. Results
+    must be JSON-serializable. A worker handles one request at a time.
+    """
+    def __init__(self, python_executable: str):
+        """
+        Starts the worker.
+
+        Args:
+            python_executable: The Python executable of the environment.
+        """
+        self.python_executable = str(python_executable)
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            [self.python_executable, "-c", _WORKER_SOURCE],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1,
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _request(self, request: dict) -> dict:
+        with self._lock:
+            if not self.alive:
+                raise RuntimeError(f"Worker process has exited with status {self._process.returncode}.")
+            try:
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+                line = self._process.stdout.readline()
+            except (BrokenPipeError, OSError) as e:
+                raise RuntimeError(f"Lost connection to worker process: {e}") from e
+            if not line:
+                self._process.wait()
+                raise RuntimeError(f"Worker process has exited with status {self._process.returncode}.")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(f"{response['error']} in worker: {response['message']}\n{response['traceback']}")
+        return response
+
+    def run(self, code: str) -> str:
+        """Executes code in the worker's persistent namespace and returns what it printed."""
+        return self._request({"op": "run", "code": code})["stdout"]
+
+    def call(self, module: str, func: str, *args, **kwargs):
+        """Imports module (once) in the worker, calls module.func(*args, **kwargs) and returns the result."""
+        return self._request({"op": "call", "module": module, "func": func, "args": list(args), "kwargs": kwargs})["result"]
+
+    def close(self) -> None:
+        if self._process.stdin and not self._process.stdin.closed:
+            with contextlib.suppress(OSError):
+                self._process.stdin.close()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class VenvWorkerPool:
+    """
+    Up to `size` VenvWorkers for the same environment, started on demand, so
+    several threads can run code in the environment in parallel. Every worker
+    has its own namespace; code passed to run() should not rely on state left
+    by an earlier run() unless size is 1.
+    """
+    def __init__(self, python_executable: str, size: int = 1):
+        """
+        Initializes the pool.
+
+        Args:
+            python_executable: The Python executable of the environment.
+            size: Maximum number of worker processes.
+        """
+        self.python_executable = str(python_executable)
+        self.size = max(1, size)
+        self._idle: List[VenvWorker] = []
+        self._workers: List[VenvWorker] = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._closed = False
+
+    def start(self, count: Optional[int] = None) -> None:
+        """Starts workers ahead of use, up to count (default: size)."""
+        with self._available:
+            while len(self._workers) < min(count or self.size, self.size):
+                worker = VenvWorker(self.python_executable)
+                self._workers.append(worker)
+                self._idle.append(worker)
+                self._available.notify()
+
+    @contextlib.contextmanager
+    def _worker(self) -> Iterator[VenvWorker]:
+        with self._available:
+            while True:
+                if self._closed:
+                    raise RuntimeError("VenvWorkerPool is closed.")
+                if self._idle:
+                    worker = self._idle.pop()
+                    break
+                if len(self._workers) < self.size:
+                    worker = VenvWorker(self.python_executable)
+                    self._workers.append(worker)
+                    break
+                self._available.wait()
+        try:
+            yield worker
+        finally:
+            with self._available:
+                if worker.alive and not self._closed:
+                    self._idle.append(worker)
+                else:
+                    # Drop dead workers; a waiter starts a replacement in their slot.
+                    if worker in self._workers:
+                        self._workers.remove(worker)
+                    worker.close()
+                self._available.notify()
+
+    def run(self, code: str) -> str:
+        with self._worker() as worker:
+            return worker.run(code)
+
+    def call(self, module: str, func: str, *args, **kwargs):
+        with self._worker() as worker:
+            return worker.call(module, func, *args, **kwargs)
+
+    def close(self) -> None:
+        with self._available:
+            self._closed = True
+            workers, self._workers = self._workers, []
+            self._idle.clear()
+            self._available.notify_all()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class LazyVenvPython(os.PathLike):
+    """
+    Returned by a lazy TempVenv instead of the Python path. It can be passed
+    anywhere a path is accepted (subprocess, open, os.fspath); converting it to
+    a path blocks until the environment is built and raises any setup error.
+    """
+    def __init__(self, build: Callable[[], str], start: bool):
+        self._build = build
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._path: Optional[str] = None
+        self._error: Optional[BaseException] = None
+        if start:
+            self.start()
+
+    def _run(self) -> None:
+        try:
+            self._path = self._build()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    def start(self) -> None:
+        """Starts building in the background if that has not happened yet."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The TempVenv has already exited.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="TempVenv-lazy-build", daemon=True)
+                self._thread.start()
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> str:
+        """Builds the environment if needed and returns the path to its Python executable."""
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"The environment was not ready after {timeout} seconds.")
+        if self._error is not None:
+            raise self._error
+        return self._path
+
+    def close(self) -> None:
+        """Prevents further builds and waits for a running one to finish."""
+        with self._lock:
+            self._closed = True
+        if self._thread is not None:
+            self._done.wait()
+
+    def __fspath__(self) -> str:
+        return self.wait()
+
+    def __str__(self) -> str:
+        return self.wait()
+
+    def __repr__(self) -> str:
+        state = "ready" if self.ready() else "building" if self.started else "not started"
+        return f"<LazyVenvPython {state}{': ' + self._path if self._path else ''}>"
+
 
 class TempVenv:
     """
@@ -12,15 +1497,33 @@ class TempVenv:
     optionally installs specified packages, and activates it for the
     duration of the with block.
     """
+    OUTPUT_TAIL_LINES = 200
+
     def __init__(
         self,
         packages: Optional[List[str]] = None,
         python_executable: Optional[str] = None,
-        cleanup: bool = True,
+        cleanup: Union[bool, str] = True,
         pip_options: Optional[List[str]] = None,
         venv_options: Optional[List[str]] = None,
         requirements_file: Optional[str] = None,
         verbose: bool = False,
+        cache: Optional[Union[str, VenvCache]] = None,
+        pool: Optional[TempVenvPool] = None,
+        template: Optional[VenvTemplate] = None,
+        link_mode: str = "auto",
+        timeout: Optional[float] = None,
+        single_pass: bool = False,
+        lock_file: Optional[str] = None,
+        wheelhouse: Optional[Union[str, Wheelhouse]] = None,
+        lazy: Optional[str] = None,
+        on_phase: Optional[Callable[[str, float], None]] = None,
+        trace_file: Optional[str] = None,
+        python_version: Optional[str] = None,
+        registry: Optional[InterpreterRegistry] = None,
+        workers: int = 0,
+        store: Optional[Union[str, PackageStore]] = None,
+        on_output: Optional[Callable[[str, str], None]] = None,
     ):
         """
         Initializes the TempVenv context manager.
@@ -28,136 +1531,1179 @@ class TempVenv:
         Args:
             packages: A list of strings specifying packages to install.
             python_executable: Path to the Python executable for the venv.
-            cleanup: If True, remove the temporary directory on exit.
+            cleanup: If True, remove the temporary directory on exit. If
+                "background", the directory is moved into a trash area next to
+                it on exit and deleted on a background thread, so exiting does
+                not wait for a large tree to be removed.
             pip_options: Additional options for pip install commands.
             venv_options: Additional options for venv creation.
             requirements_file: Path to a requirements.txt file.
             verbose: If True, print detailed logs.
+            cache: A VenvCache, or a directory to use as one. When given, built
+                environments are stored in the cache and identical later builds
+                are copied from it without running any installer.
+            pool: A TempVenvPool to take a pre-created environment from. The
+                environment is handed back to the pool on exit, so cleanup
+                cannot be False. Ignored when cache is given.
+            template: A VenvTemplate to clone the environment from. Only
+                packages and requirements_file are installed on top of it.
+            link_mode: How cloned package files share storage with their source:
+                "auto" (reflink, then hardlink unless running as root, then
+                copy), "reflink", "hardlink" or "copy". Only "hardlink" lets a
+                root process modify the source by writing to a clone.
+            timeout: Maximum number of seconds each setup command may run.
+            single_pass: If True, install requirements_file and packages with
+                a single uv resolution instead of one install per source.
+            lock_file: Path of a pinned requirements file. If it does not
+                exist, requirements_file and packages are resolved once into
+                it; if it exists, exactly its pins are installed without
+                resolving. Delete it to re-resolve.
+            wheelhouse: A Wheelhouse, or a directory to use as one. Packages
+                are then installed only from it, never from an index.
+            lazy: If "background", entering returns a LazyVenvPython at once
+                and builds the environment on a background thread. If
+                "on_demand", the environment is only built the first time the
+                LazyVenvPython is used as a path.
+            on_phase: Called with the phase name and its duration in seconds
+                each time a setup or cleanup phase finishes.
+            trace_file: If given, the recorded phases are written to this path
+                on exit in Chrome trace event format (chrome://tracing, Perfetto).
+            python_version: A version spec such as ">=3.11" or "3.12". The
+                newest matching interpreter found on PATH is used. Cannot be
+                combined with python_executable.
+            registry: The InterpreterRegistry used to find and fingerprint
+                interpreters. Defaults to a registry shared by the process.
+            workers: Number of persistent worker processes to start in the
+                environment on enter, for use through run() and call(). If 0,
+                a single worker is started on the first run() or call().
+            store: A PackageStore, or a directory to use as one. Packages are
+                then linked from the shared store instead of being extracted
+                into each environment.
+            on_output: Called with the command description and each output
+                line of uv as it is produced, possibly from a background
+                thread. Only the last OUTPUT_TAIL_LINES lines of each stream
+                are kept for error messages.
         """
+        if python_version and python_executable:
+            raise ValueError("python_version cannot be combined with python_executable.")
+        if cleanup and cleanup not in (True, "background"):
+            raise ValueError(f"Unknown cleanup mode: {cleanup!r}")
+        if lazy not in (None, "background", "on_demand"):
+            raise ValueError(f"Unknown lazy mode: {lazy!r}")
+        if template is not None and (cache is not None or pool is not None):
+            raise ValueError("template cannot be combined with cache or pool.")
+        if pool is not None and not cleanup:
+            raise ValueError("pool cannot be combined with cleanup=False: the environment goes back to the pool on exit.")
         self.packages = packages if packages is not None else []
         self.python_executable_pref = python_executable
-        self.cleanup = cleanup
+        self.python_version = python_version
+        self.registry = registry if registry is not None else default_registry
+        self.cleanup = cleanup or False
         self.pip_options = pip_options if pip_options is not None else []
+        self.wheelhouse = Wheelhouse(wheelhouse) if isinstance(wheelhouse, (str, Path)) else wheelhouse
+        if self.wheelhouse is not None:
+            self.pip_options = self.pip_options + self.wheelhouse.pip_options()
         self.venv_options = venv_options if venv_options is not None else []
         self.requirements_file = requirements_file
         self.verbose = verbose
+        self.cache = VenvCache(cache) if isinstance(cache, (str, Path)) else cache
+        self.pool = pool
+        self._pooled = False
+        self._pool_python: Optional[str] = None
+        self.template = template
+        self.link_mode = link_mode
+        self.timeout = timeout
+        self.single_pass = single_pass
+        self.lock_file = lock_file
+        self.lazy = lazy
+        self.lazy_python: Optional[LazyVenvPython] = None
+        self.on_phase = on_phase
+        self.trace_file = trace_file
+        self.timings: Dict[str, float] = {}
+        self.cache_hit: Optional[bool] = None
+        self.trace_events: List[dict] = []
+        self.workers = workers
+        self.worker_pool: Optional[VenvWorkerPool] = None
+        self._worker_lock = threading.Lock()
+        self.store = PackageStore(store) if isinstance(store, (str, Path)) else store
+        self._store_ref: Optional[Path] = None
+        self.on_output = on_output
         self.temp_dir = None
         self.venv_python_executable = None
+        self.base_python: Optional[str] = None
         self.temp_dir_path_str: Optional[str] = None
 
+    @classmethod
+    def create_many(cls, specs: Iterable[Dict[str, Any]], max_workers: int = 4) -> Iterator[BatchResult]:
+        """
+        Builds many environments concurrently on a thread pool.
+
+        Args:
+            specs: Dicts of TempVenv keyword arguments, one per environment.
+                Identical specs (ignoring package order) are built only once.
+            max_workers: Maximum number of environments built at the same time.
+
+        Yields:
+            A BatchResult per unique spec, in the order the builds finish. A
+            failed build is reported in its result and does not stop the batch.
+            Environments that were not yielded, because the caller stopped
+            iterating early, are cleaned up.
+        """
+        unique: Dict[str, List[Any]] = {}
+        for spec in specs:
+            key = _spec_key(spec)
+            if key in unique:
+                unique[key][1] += 1
+            else:
+                unique[key] = [spec, 1]
+
+        def build(spec: Dict[str, Any], count: int) -> BatchResult:
+            start = time.perf_counter()
+            try:
+                # Invalid arguments fail this spec only, like a failed build.
+                venv = cls(**spec)
+                python = venv.__enter__()
+            except Exception as e:
+                return BatchResult(spec, None, None, time.perf_counter() - start, e, count)
+            return BatchResult(spec, venv, python, time.perf_counter() - start, None, count)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(build, spec, count) for spec, count in unique.values()]
+            pending = set(futures)
+            try:
+                for future in as_completed(futures):
+                    pending.discard(future)
+                    yield future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+                for future in pending:
+                    if not future.cancelled():
+                        future.result().close()
+
+    @contextlib.contextmanager
+    def _phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record_phase(name, start, time.perf_counter() - start)
+
+    def _record_phase(self, name: str, start: float, duration: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+        self.trace_events.append({"name": name, "start": start, "duration": duration, "thread": threading.get_ident()})
+        if self.on_phase is not None:
+            self.on_phase(name, duration)
+
+    _UV_SUMMARY = re.compile(r"^(Resolved|Prepared|Uninstalled|Installed|Audited) .* in ([\d.]+)(ms|s|µs)$", re.MULTILINE)
+    _UV_PHASES = {"Resolved": "resolve", "Prepared": "download", "Uninstalled": "uninstall", "Installed": "install", "Audited": "audit"}
+
+    def _record_uv_phases(self, stderr: Optional[str], start: float) -> None:
+        # uv resolves, downloads and installs within one command but reports each
+        # step's duration; lay them out back to back from the command's start.
+        for verb, amount, unit in self._UV_SUMMARY.findall(stderr or ""):
+            duration = float(amount) * {"ms": 1e-3, "s": 1.0, "µs": 1e-6}[unit]
+            self._record_phase(f"install.{self._UV_PHASES[verb]}", start, duration)
+            start += duration
+
+    def export_trace(self, path: str) -> None:
+        """Writes the recorded phases to path in Chrome trace event format."""
+        origin = min((event["start"] for event in self.trace_events), default=0.0)
+        events = [{
+            "name": event["name"],
+            "ph": "X",
+            "ts": round((event["start"] - origin) * 1e6),
+            "dur": round(event["duration"] * 1e6),
+            "pid": os.getpid(),
+            "tid": event["thread"],
+        } for event in self.trace_events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, indent=1)
+
     def _find_python_executable(self) -> str:
         if self.python_executable_pref:
             if self.verbose:
                 print(f"Using preferred Python executable: {self.python_executable_pref}")
             return self.python_executable_pref
+        if self.python_version:
+            info = self.registry.find(self.python_version)
+            if self.verbose:
+                print(f"Found suitable Python executable: {info.executable} ({'.'.join(map(str, info.version))}) for {self.python_version}")
+            return info.executable
         executables_to_try = [sys.executable, "python3", "python"]
         for executable in executables_to_try:
             if executable:
                 try:
-                    cmd = [executable, "--version"]
                     if self.verbose:
                         print(f"Attempting to use Python executable: {executable} by checking version.")
-                    self._run_subprocess(cmd, "Checking Python version", python_executable_for_module=None)
+                    self.registry.probe(executable)
                     if self.verbose:
                         print(f"Found suitable Python executable: {executable}")
                     return executable
-                except (subprocess.CalledProcessError, FileNotFoundError) as e:
+                except (subprocess.SubprocessError, OSError, ValueError) as e:
                     if self.verbose:
                         print(f"Failed to use '{executable}': {e}")
         raise RuntimeError("Could not find a suitable Python executable.")
 
-    def _run_subprocess(self, command: List[str], description: str, check: bool = True, capture_output: bool = True, text: bool = True, extra_env: Optional[dict] = None, python_executable_for_module: Optional[str] = None) -> subprocess.CompletedProcess:
+    def _run_subprocess(self, command: List[str], description: str, check: bool = True, extra_env: Optional[dict] = None, python_executable_for_module: Optional[str] = None, keep_output: bool = False) -> subprocess.CompletedProcess:
+        command, env, stdout, stderr = self._prepare_subprocess(command, description, extra_env, python_executable_for_module, keep_output)
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace", env=env) as process:
+            readers = [threading.Thread(target=stream.pump, args=(pipe,), daemon=True)
+                       for stream, pipe in ((stdout, process.stdout), (stderr, process.stderr))]
+            for reader in readers:
+                reader.start()
+            try:
+                returncode = process.wait(timeout=self.timeout)
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                for reader in readers:
+                    reader.join()
+        return self._finish_subprocess(command, returncode, stdout, stderr, check)
+
+    def _prepare_subprocess(self, command: List[str], description: str, extra_env: Optional[dict], python_executable_for_module: Optional[str], keep_output: bool) -> Tuple[List[str], Dict[str, str], _OutputStream, _OutputStream]:
         if python_executable_for_module:
             command = [python_executable_for_module, "-m"] + command
         if self.verbose:
             print(f"Running command for {description}: {' '.join(command)}")
         env = os.environ.copy()
+        env.update(self._store_env())
         if extra_env:
             env.update(extra_env)
-        process = subprocess.run(command, check=check, capture_output=capture_output, text=text, env=env)
-        if self.verbose:
-            if process.stdout:
-                print(f"Stdout for {description}:\n{process.stdout.strip()}")
-            if process.stderr:
-                print(f"Stderr for {description}:\n{process.stderr.strip()}")
-        return process
+        on_line = None
+        if self.verbose or self.on_output is not None:
+            def on_line(line: str) -> None:
+                if self.verbose:
+                    print(f"[{description}] {line}")
+                if self.on_output is not None:
+                    self.on_output(description, line)
+        # stdout is kept whole only for commands whose output is parsed, such as freeze and compile.
+        stdout = _OutputStream(on_line, None if keep_output else self.OUTPUT_TAIL_LINES)
+        # uv prints its timing summaries before the per-package lines; keep them for _record_uv_phases().
+        stderr = _OutputStream(on_line, self.OUTPUT_TAIL_LINES, keep=self._UV_SUMMARY)
+        return command, env, stdout, stderr
 
-    def __enter__(self):
+    @staticmethod
+    def _finish_subprocess(command: List[str], returncode: int, stdout: _OutputStream, stderr: _OutputStream, check: bool) -> subprocess.CompletedProcess:
+        result = subprocess.CompletedProcess(command, returncode, stdout.text(), stderr.text())
+        if check:
+            result.check_returncode()
+        for stream in (stdout, stderr):
+            if stream.error is not None:
+                raise stream.error
+        return result
+
+    def _store_env(self) -> Dict[str, str]:
+        if self.store is None or self.temp_dir_path_str is None:
+            return {}
+        if self._store_ref is None:
+            self._store_ref = self.store.register(self.temp_dir_path_str)
+        return self.store.uv_env(self.temp_dir_path_str)
+
+    def _interpreter_fingerprint(self, base_python: str) -> str:
+        return self.registry.probe(base_python).fingerprint
+
+    def _cache_key(self, base_python: str) -> str:
+        requirements_text = None
+        if self.requirements_file and Path(self.requirements_file).is_file():
+            requirements_text = Path(self.requirements_file).read_text()
+        if self.lock_file and Path(self.lock_file).is_file():
+            requirements_text = (requirements_text or "") + Path(self.lock_file).read_text()
+        return VenvCache.make_key(self._interpreter_fingerprint(base_python), self.packages, requirements_text, self.pip_options, self.venv_options)
+
+    def _build_venv(self, temp_dir_path: Path, base_python: str) -> None:
+        self._create_venv(temp_dir_path, base_python)
+        self._install_packages(base_python)
+
+    def _create_venv(self, temp_dir_path: Path, base_python: str) -> None:
+        venv_creation_command = self._venv_creation_command(temp_dir_path, base_python)
+        with self._phase("create"):
+            self._run_subprocess(venv_creation_command, "uv venv creation", python_executable_for_module=base_python)
+        self._check_venv_created(temp_dir_path)
+
+    def _venv_creation_command(self, temp_dir_path: Path, base_python: str) -> List[str]:
         if self.verbose:
-            print("Creating temporary directory for virtual environment...")
-        self.temp_dir = tempfile.TemporaryDirectory()
-        temp_dir_path = Path(self.temp_dir.name)
-        self.temp_dir_path_str = str(temp_dir_path)
+            print(f"Creating virtual environment using uv (with Python {base_python}) at {temp_dir_path}...")
+
+        venv_creation_command = ["uv", "venv", str(temp_dir_path), "--python", base_python]
+        if self.venv_options:
+            venv_creation_command.extend(self.venv_options)
+        return venv_creation_command
+
+    def _check_venv_created(self, temp_dir_path: Path) -> None:
+        self.venv_python_executable = _venv_python_path(temp_dir_path)
+
+        if not self.venv_python_executable.is_file():
+            raise RuntimeError(f"Python executable not found at {self.venv_python_executable} after uv venv creation")
         if self.verbose:
-            print(f"Temporary directory created at: {temp_dir_path}")
+            print(f"Virtual environment Python executable: {self.venv_python_executable}")
 
-        try:
-            base_python = self._find_python_executable() # Keep this to allow choosing a python version for uv
+    def _install_packages(self, base_python: str) -> None:
+        self._resolve_lock_file(base_python)
+        for message, cmd, description in self._install_steps():
             if self.verbose:
-                print(f"Creating virtual environment using uv (with Python {base_python}) at {temp_dir_path}...")
+                print(message)
+            start = time.perf_counter()
+            with self._phase("install"):
+                result = self._run_subprocess(cmd, description, python_executable_for_module=base_python)
+            self._record_uv_phases(result.stderr, start)
 
-            venv_creation_command = ["uv", "venv", str(temp_dir_path), "--python", base_python]
-            if self.venv_options:
-                venv_creation_command.extend(self.venv_options)
-            self._run_subprocess(venv_creation_command, "uv venv creation", python_executable_for_module=base_python)
+    def _existing_requirements_file(self) -> Optional[str]:
+        if self.requirements_file and Path(self.requirements_file).is_file():
+            return self.requirements_file
+        return None
 
-            if os.name == "nt":
-                self.venv_python_executable = temp_dir_path / "Scripts" / "python.exe"
-            else:
-                self.venv_python_executable = temp_dir_path / "bin" / "python"
+    def _check_wheelhouse(self) -> None:
+        if self.wheelhouse is None:
+            return
+        if self.lock_file and Path(self.lock_file).is_file():
+            missing = self.wheelhouse.missing(requirements_file=self.lock_file)
+        else:
+            missing = self.wheelhouse.missing(list(self.packages), self._existing_requirements_file())
+        if missing:
+            raise RuntimeError(f"Wheelhouse {self.wheelhouse.path} has no artifact for: {', '.join(missing)}")
 
-            if not self.venv_python_executable.is_file():
-                raise RuntimeError(f"Python executable not found at {self.venv_python_executable} after uv venv creation")
-            if self.verbose:
-                print(f"Virtual environment Python executable: {self.venv_python_executable}")
+    def _lock_file_step(self, base_python: str) -> Optional[Tuple[str, List[str], str, List[Path]]]:
+        """
+        Returns the (log message, uv command, description, scratch files) that
+        resolves into a scratch file next to the lock file, or None if the lock
+        file exists or there is nothing to resolve.
+        """
+        requirements_file = self._existing_requirements_file()
+        if not self.lock_file or Path(self.lock_file).is_file() or not (requirements_file or self.packages):
+            return None
+        self._check_wheelhouse()
+        lock_path = Path(self.lock_file)
+        scratch = f".{lock_path.name}.{uuid.uuid4().hex}"
+        lock_input, resolved = lock_path.with_name(scratch + ".in"), lock_path.with_name(scratch + ".txt")
+        lines = list(self.packages)
+        if requirements_file:
+            lines.insert(0, f"-r {Path(requirements_file).resolve()}")
+        lock_input.write_text("\n".join(lines) + "\n")
+        cmd = ["uv", "pip", "compile"] + self.pip_options + [str(lock_input), "-o", str(resolved), "--python", base_python]
+        return (f"Resolving packages into lock file using uv: {self.lock_file}", cmd, f"uv resolving into {self.lock_file}", [lock_input, resolved])
 
-            # --- Package Installation Logic (using uv) ---
-            packages_to_install = list(self.packages)
-            install_commands_run = False
+    def _publish_lock_file(self, resolved: Path) -> None:
+        lock_path = Path(self.lock_file)
+        with _file_lock(lock_path.with_name(lock_path.name + ".lock")):
+            # The first build to finish resolving wins, so concurrent builds all install the same pins.
+            if not lock_path.is_file():
+                os.replace(resolved, lock_path)
 
-            if self.requirements_file:
-                if Path(self.requirements_file).is_file():
-                    if self.verbose:
-                        print(f"Installing packages from requirements file using uv: {self.requirements_file}")
-                    # Assuming 'uv pip install' is the command.
-                    # We use self.venv_python_executable to ensure uv uses the venv's Python,
-                    # though uv might handle this automatically when running from within a venv path.
-                    # For safety, explicitly using the venv's uv/pip might be better if uv installs itself there.
-                    # For now, assume 'uv' is in PATH and context-aware or can be directed.
-                    cmd = ["uv", "pip", "install"] + self.pip_options + ["-r", self.requirements_file, "--python", str(self.venv_python_executable)]
-                    self._run_subprocess(cmd, f"uv installing from {self.requirements_file}", python_executable_for_module=base_python)
-                    install_commands_run = True
-                else:
-                    if self.verbose:
-                         print(f"Warning: Requirements file {self.requirements_file} not found. It will be ignored.")
+    def _resolve_lock_file(self, base_python: str) -> None:
+        step = self._lock_file_step(base_python)
+        if step is None:
+            return
+        message, cmd, description, scratch_files = step
+        if self.verbose:
+            print(message)
+        try:
+            start = time.perf_counter()
+            with self._phase("install"):
+                result = self._run_subprocess(cmd, description, python_executable_for_module=base_python)
+            self._record_uv_phases(result.stderr, start)
+            self._publish_lock_file(scratch_files[1])
+        finally:
+            self._remove_scratch_files(scratch_files)
+
+    @staticmethod
+    def _remove_scratch_files(paths: List[Path]) -> None:
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+
+    def _install_steps(self) -> List[Tuple[str, List[str], str]]:
+        """Returns the (log message, uv command, description) of each install command to run."""
+        # --- Package Installation Logic (using uv) ---
+        packages_to_install = list(self.packages)
+        python_args = ["--python", str(self.venv_python_executable)]
+        steps = []
+
+        requirements_file = self._existing_requirements_file()
+        if self.requirements_file and requirements_file is None and self.verbose:
+            print(f"Warning: Requirements file {self.requirements_file} not found. It will be ignored.")
+
+        self._check_wheelhouse()
+
+        if self.lock_file and Path(self.lock_file).is_file():
+            # The lock is fully pinned, so nothing needs resolving; _resolve_lock_file() has created it if needed.
+            cmd = ["uv", "pip", "install"] + self.pip_options + ["--no-deps", "-r", self.lock_file] + python_args
+            steps.append((f"Installing pinned packages from lock file using uv: {self.lock_file}", cmd, f"uv installing from {self.lock_file}"))
+        elif self.single_pass and requirements_file and packages_to_install:
+            cmd = ["uv", "pip", "install"] + self.pip_options + ["-r", requirements_file] + packages_to_install + python_args
+            steps.append((f"Installing packages from {requirements_file} and {', '.join(packages_to_install)} in a single pass using uv", cmd, "uv installing packages"))
+        else:
+            if requirements_file:
+                # Assuming 'uv pip install' is the command.
+                # We use self.venv_python_executable to ensure uv uses the venv's Python,
+                # though uv might handle this automatically when running from within a venv path.
+                # For safety, explicitly using the venv's uv/pip might be better if uv installs itself there.
+                # For now, assume 'uv' is in PATH and context-aware or can be directed.
+                cmd = ["uv", "pip", "install"] + self.pip_options + ["-r", requirements_file] + python_args
+                steps.append((f"Installing packages from requirements file using uv: {requirements_file}", cmd, f"uv installing from {requirements_file}"))
 
             if packages_to_install:
-                if self.verbose:
-                    print(f"Installing specified packages using uv: {', '.join(packages_to_install)}")
-                cmd = ["uv", "pip", "install"] + self.pip_options + packages_to_install + ["--python", str(self.venv_python_executable)]
-                self._run_subprocess(cmd, "uv installing packages", python_executable_for_module=base_python)
-                install_commands_run = True
+                cmd = ["uv", "pip", "install"] + self.pip_options + packages_to_install + python_args
+                steps.append((f"Installing specified packages using uv: {', '.join(packages_to_install)}", cmd, "uv installing packages"))
 
-            if not install_commands_run and self.verbose:
-                 print("No packages or requirements file specified for installation with uv.")
+        if not steps and self.verbose:
+             print("No packages or requirements file specified for installation with uv.")
+        return steps
 
-            return str(self.venv_python_executable)
+    def _build_venv_cached(self, temp_dir_path: Path, base_python: str) -> None:
+        # Resolve first, so the key includes the pins and later builds of this spec hit.
+        self._resolve_lock_file(base_python)
+        with self._phase("cache_lookup"):
+            key = self._cache_key(base_python)
+        # Hits only need the entry to stay in place, so they clone concurrently under a shared lock.
+        with self.cache.lock(key, shared=True):
+            if self._clone_cached(key, temp_dir_path):
+                return
+        with self.cache.lock(key):
+            # Another process may have built the entry while this one waited.
+            if self._clone_cached(key, temp_dir_path):
+                return
+            if self.verbose:
+                print(f"Cache miss: building environment for cache key {key}")
+            self._build_venv(temp_dir_path, base_python)
+            with self._phase("cache_store"):
+                self.cache.store(key, temp_dir_path)
+        with self._phase("cache_evict"):
+            evicted = self.cache.evict()
+        if evicted and self.verbose:
+            print(f"Evicted {len(evicted)} environment(s) from the cache")
+
+    def _clone_cached(self, key: str, temp_dir_path: Path) -> bool:
+        with self._phase("cache_lookup"):
+            cached_venv = self.cache.lookup(key)
+        self.cache_hit = cached_venv is not None
+        if cached_venv is None:
+            return False
+        if self.verbose:
+            print(f"Cache hit: reusing environment {cached_venv}")
+        with self._phase("clone"):
+            _clone_tree(cached_venv, temp_dir_path, self.link_mode)
+        self.venv_python_executable = _venv_python_path(temp_dir_path)
+        return True
+
+    def _build_venv_from_template(self, temp_dir_path: Path) -> None:
+        if self.verbose:
+            print(f"Cloning template environment {self.template.path} into {temp_dir_path}...")
+        with self._phase("clone"):
+            self.template.clone_into(temp_dir_path, self.link_mode)
+        self.venv_python_executable = _venv_python_path(temp_dir_path)
+        self.base_python = self.template.base_python
+        self._install_packages(self.base_python)
 
+    @contextlib.contextmanager
+    def _setup_errors(self) -> Iterator[None]:
+        try:
+            yield
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"Error during virtual environment setup: Command '{' '.join(e.cmd)}' timed out after {e.timeout} seconds.") from e
         except subprocess.CalledProcessError as e:
             error_detail = f"Command '{' '.join(e.cmd)}' returned non-zero exit status {e.returncode}."
             error_detail += f"\nStdout: {e.stdout.strip()}" if e.stdout else ""
             error_detail += f"\nStderr: {e.stderr.strip()}" if e.stderr else ""
+            missing = Wheelhouse.missing_from_error(e.stderr) if self.wheelhouse is not None else []
+            if missing:
+                error_detail += f"\nWheelhouse {self.wheelhouse.path} has no artifact for: {', '.join(missing)}"
             raise RuntimeError(f"Error during virtual environment setup: {error_detail}") from e
+        except RuntimeError:
+            raise # Already a clear setup error, such as a wheelhouse missing artifacts
         except Exception as e:
             raise RuntimeError(f"An unexpected error occurred during venv setup: {e}") from e
 
+    def __enter__(self):
+        if self.lazy:
+            self.lazy_python = LazyVenvPython(self._enter_now, start=self.lazy == "background")
+            return self.lazy_python
+        return self._enter_now()
+
+    def _start_workers(self) -> None:
+        if self.workers:
+            with self._phase("workers"):
+                with self._worker_lock:
+                    self.worker_pool = VenvWorkerPool(str(self.venv_python_executable), self.workers)
+                self.worker_pool.start()
+
+    def _get_worker_pool(self) -> VenvWorkerPool:
+        # Wait for a lazy build first: it may start the workers itself.
+        self._require_entered()
+        with self._worker_lock:
+            if self.worker_pool is None:
+                self.worker_pool = VenvWorkerPool(str(self.venv_python_executable), self.workers or 1)
+            return self.worker_pool
+
+    def run(self, code: str) -> str:
+        """
+        Executes code in a persistent worker process inside the environment
+        and returns what it printed. Imports and globals persist between calls.
+        """
+        return self._get_worker_pool().run(code)
+
+    def call(self, module: str, func: str, *args, **kwargs):
+        """
+        Calls module.func(*args, **kwargs) in a persistent worker process
+        inside the environment and returns the JSON-serializable result.
+        """
+        return self._get_worker_pool().call(module, func, *args, **kwargs)
+
+    def _enter_now(self) -> str:
+        venv_python = self._materialize()
+        self._start_workers()
+        return venv_python
+
+    def _materialize(self) -> str:
+        if self.pool is not None and self.cache is None:
+            return self._enter_pooled()
+        if self.verbose:
+            print("Creating temporary directory for virtual environment...")
+        with self._phase("tempdir"):
+            self.temp_dir = tempfile.TemporaryDirectory(prefix=_temp_dir_prefix())
+        temp_dir_path = Path(self.temp_dir.name)
+        self.temp_dir_path_str = str(temp_dir_path)
+        if self.verbose:
+            print(f"Temporary directory created at: {temp_dir_path}")
+
+        if self.template is not None:
+            with self._phase("template_build"):
+                self.template.build() # Raises its own setup errors
+        with self._setup_errors():
+            if self.template is not None:
+                self._build_venv_from_template(temp_dir_path)
+                return str(self.venv_python_executable)
+            with self._phase("discover"):
+                base_python = self._find_python_executable() # Keep this to allow choosing a python version for uv
+            self.base_python = base_python
+            if self.cache is not None:
+                self._build_venv_cached(temp_dir_path, base_python)
+            else:
+                self._build_venv(temp_dir_path, base_python)
+            return str(self.venv_python_executable)
+
+    def _enter_pooled(self):
+        with self._setup_errors():
+            if self.python_version:
+                # The pool is keyed by executable, so pick the interpreter matching python_version first.
+                with self._phase("discover"):
+                    self._pool_python = self._find_python_executable()
+            else:
+                self._pool_python = self.python_executable_pref
+            with self._phase("pool_acquire"):
+                self.temp_dir, base_python = self.pool.acquire(self._pool_python, self.venv_options)
+            self.base_python = base_python
+            self._pooled = True
+            temp_dir_path = Path(self.temp_dir.name)
+            self.temp_dir_path_str = str(temp_dir_path)
+            self.venv_python_executable = _venv_python_path(temp_dir_path)
+            if self.verbose:
+                print(f"Using pooled virtual environment at: {temp_dir_path}")
+            self._install_packages(base_python)
+            return str(self.venv_python_executable)
+
+    def _require_entered(self) -> None:
+        if self.lazy_python is not None:
+            self.lazy_python.wait()
+        if self.venv_python_executable is None or self.temp_dir is None:
+            raise RuntimeError("The environment is only available inside the with block.")
+
+    def _run_uv(self, args: List[str], description: str, requirements: Optional[List[str]] = None, keep_output: bool = False) -> subprocess.CompletedProcess:
+        cmd = ["uv", "pip"] + args + ["--python", str(self.venv_python_executable)]
+        if requirements is None:
+            return self._run_subprocess(cmd, description, python_executable_for_module=self.base_python, keep_output=keep_output)
+        requirements_path = Path(self.temp_dir_path_str) / f"temp-venv-{uuid.uuid4().hex}.txt"
+        requirements_path.write_text("\n".join(requirements) + "\n")
+        try:
+            cmd.insert(3, str(requirements_path)) # Right after the "uv pip <subcommand>"
+            return self._run_subprocess(cmd, description, python_executable_for_module=self.base_python, keep_output=keep_output)
+        finally:
+            requirements_path.unlink()
+
+    def snapshot(self) -> List[str]:
+        """Returns the environment's installed distributions as pinned requirement lines."""
+        self._require_entered()
+        with self._setup_errors():
+            freeze = self._run_uv(["freeze"], "uv recording installed packages", keep_output=True)
+        return [line for line in freeze.stdout.splitlines() if line.strip()]
+
+    @staticmethod
+    def _diff_snapshots(before: List[str], after: List[str]) -> Dict[str, List[str]]:
+        def by_name(lines):
+            return {(_requirement_name(line) or line): line for line in lines}
+        old, new = by_name(before), by_name(after)
+        return {
+            "installed": sorted(new[name] for name in new.keys() - old.keys()),
+            "removed": sorted(old[name] for name in old.keys() - new.keys()),
+            "changed": sorted(f"{old[name]} -> {new[name]}" for name in old.keys() & new.keys() if old[name] != new[name]),
+        }
+
+    def _sync(self, pinned: List[str], description: str) -> Dict[str, List[str]]:
+        before = self.snapshot()
+        with self._setup_errors(), self._phase("reconfigure"):
+            self._run_uv(["sync", "--allow-empty-requirements"] + self.pip_options, description, requirements=pinned)
+        if self.worker_pool is not None:
+            # Workers may have imported the old versions; restart them.
+            self.worker_pool.close()
+            self.worker_pool = None
+            self._start_workers()
+        return self._diff_snapshots(before, self.snapshot())
+
+    def reconfigure(self, packages: Optional[List[str]] = None, requirements_file: Optional[str] = None) -> Dict[str, List[str]]:
+        """
+        Switches the entered environment to exactly a new package set, changing
+        only what differs: missing packages are installed, changed versions are
+        replaced and packages outside the new set (with their dependencies)
+        are uninstalled.
+
+        Args:
+            packages: A list of strings specifying the new set of packages.
+            requirements_file: Path to a requirements.txt file with more of them.
+
+        Returns:
+            A dict with the "installed", "removed" and "changed" requirement lines.
+        """
+        self._require_entered()
+        requirements = list(packages or [])
+        if requirements_file:
+            requirements.insert(0, f"-r {Path(requirements_file).resolve()}")
+        with self._setup_errors(), self._phase("reconfigure"):
+            compiled = self._run_uv(["compile", "--quiet", "--no-header", "--no-annotate"] + self.pip_options,
+                                    "uv resolving new package set", requirements=requirements, keep_output=True)
+        pinned = [line for line in compiled.stdout.splitlines() if line.strip() and not line.startswith("#")]
+        diff = self._sync(pinned, "uv applying package changes")
+        self.packages = list(packages or [])
+        self.requirements_file = requirements_file
+        return diff
+
+    def rollback(self, snapshot: List[str]) -> Dict[str, List[str]]:
+        """Restores a list returned by snapshot() without resolving anything."""
+        self._require_entered()
+        return self._sync(snapshot, "uv restoring snapshot")
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.lazy_python is not None:
+            self.lazy_python.close()
+            self.lazy_python = None
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
         if self.temp_dir:
             if self.cleanup:
                 if self.verbose:
                     print(f"Cleaning up temporary directory: {self.temp_dir.name}")
-                self.temp_dir.cleanup()
+                with self._phase("cleanup"):
+                    if self._pooled:
+                        self.pool.release(self.temp_dir, self._pool_python, self.venv_options)
+                        self._pooled = False
+                    elif self.cleanup == "background":
+                        _remove_in_background(self.temp_dir)
+                    else:
+                        self.temp_dir.cleanup()
                 self.temp_dir = None
             else:
                 if self.verbose:
                     print(f"Skipping cleanup of temporary directory: {self.temp_dir.name}")
+        if self._store_ref is not None:
+            self.store.release(self._store_ref)
+            self._store_ref = None
+        if self.trace_file:
+            self.export_trace(self.trace_file)
+
+
+class AsyncTempVenv(TempVenv):
+    """
+    An async context manager equivalent of TempVenv. The environment is created
+    and populated with asyncio subprocesses, so the event loop keeps running
+    while uv works and many environments can be built concurrently.
+
+    Accepts the same arguments as TempVenv, except cache, pool, template and
+    lazy.
+    If the enclosing task is cancelled, the running command is killed and the
+    temporary directory is removed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.cache is not None or self.pool is not None or self.template is not None or self.lazy:
+            raise ValueError("AsyncTempVenv does not support cache, pool, template or lazy.")
+
+    async def _run_subprocess_async(self, command: List[str], description: str, check: bool = True, extra_env: Optional[dict] = None, python_executable_for_module: Optional[str] = None, keep_output: bool = False) -> subprocess.CompletedProcess:
+        command, env, stdout, stderr = self._prepare_subprocess(command, description, extra_env, python_executable_for_module, keep_output)
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env)
+        try:
+            await asyncio.wait_for(asyncio.gather(stdout.pump_async(process.stdout), stderr.pump_async(process.stderr), process.wait()), self.timeout)
+        except BaseException as e:
+            with contextlib.suppress(ProcessLookupError):
+                process.kill()
+            await asyncio.shield(process.wait())
+            if isinstance(e, asyncio.TimeoutError):
+                raise subprocess.TimeoutExpired(command, self.timeout) from None
+            raise
+        return self._finish_subprocess(command, process.returncode, stdout, stderr, check)
+
+    async def __aenter__(self):
+        if self.verbose:
+            print("Creating temporary directory for virtual environment...")
+        with self._phase("tempdir"):
+            self.temp_dir = tempfile.TemporaryDirectory(prefix=_temp_dir_prefix())
+        temp_dir_path = Path(self.temp_dir.name)
+        self.temp_dir_path_str = str(temp_dir_path)
+        if self.verbose:
+            print(f"Temporary directory created at: {temp_dir_path}")
+
+        try:
+            with self._setup_errors():
+                with self._phase("discover"):
+                    # Probes are cached by the registry, so this rarely runs a subprocess.
+                    base_python = await asyncio.to_thread(self._find_python_executable)
+                self.base_python = base_python
+                venv_creation_command = self._venv_creation_command(temp_dir_path, base_python)
+                with self._phase("create"):
+                    await self._run_subprocess_async(venv_creation_command, "uv venv creation", python_executable_for_module=base_python)
+                self._check_venv_created(temp_dir_path)
+                lock_step = self._lock_file_step(base_python)
+                if lock_step is not None:
+                    message, cmd, description, scratch_files = lock_step
+                    if self.verbose:
+                        print(message)
+                    try:
+                        start = time.perf_counter()
+                        with self._phase("install"):
+                            result = await self._run_subprocess_async(cmd, description, python_executable_for_module=base_python)
+                        self._record_uv_phases(result.stderr, start)
+                        await asyncio.to_thread(self._publish_lock_file, scratch_files[1])
+                    finally:
+                        self._remove_scratch_files(scratch_files)
+                for message, cmd, description in self._install_steps():
+                    if self.verbose:
+                        print(message)
+                    start = time.perf_counter()
+                    with self._phase("install"):
+                        result = await self._run_subprocess_async(cmd, description, python_executable_for_module=base_python)
+                    self._record_uv_phases(result.stderr, start)
+                self._start_workers()
+                return str(self.venv_python_executable)
+        except asyncio.CancelledError:
+            self.temp_dir.cleanup()
+            self.temp_dir = None
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # Removing a large environment can take a while; keep it off the event loop.
+        await asyncio.to_thread(self.__exit__, exc_type, exc_val, exc_tb)
+
+
+# TempVenv arguments a daemon client may choose; everything else is up to the daemon.
+_DAEMON_SPEC_KEYS = {"packages", "python_executable", "python_version", "pip_options", "venv_options",
+                     "requirements_file", "lock_file", "single_pass", "wheelhouse"}
+
+
+class VenvDaemon:
+    """
+    Serves ready environments to other processes over a Unix socket.
+
+    The daemon owns a VenvCache and keeps `spares` prebuilt environments for
+    every spec it has served, so a client leasing a spec it asked for before
+    gets an interpreter without waiting for a build or a clone. Clients speak
+    JSON lines (see VenvClient). A leased environment belongs to its client
+    until it is released or the client's connection closes; it is then
+    deleted, never handed out again.
+    """
+    def __init__(self, socket_path: Union[str, Path], cache: Optional[Union[str, VenvCache]] = None,
+                 spares: int = 1, verbose: bool = False):
+        """
+        Args:
+            socket_path: Path of the Unix socket to listen on.
+            cache: A VenvCache, or a directory to use as one, for building
+                environments. Environments are built without a cache if None.
+            spares: Number of prebuilt environments kept per spec.
+            verbose: If True, print detailed logs.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("The daemon needs Unix domain sockets, which this platform does not support.")
+        self.socket_path = Path(socket_path)
+        self.cache = VenvCache(cache) if isinstance(cache, (str, Path)) else cache
+        self.spares = spares
+        self.verbose = verbose
+        self.served = 0
+        self.warm_hits = 0
+        self.builds = 0
+        self._leases: Dict[str, TempVenv] = {}
+        self._spares: Dict[str, List[TempVenv]] = {}
+        self._lock = threading.Lock()
+        self._refill = ThreadPoolExecutor(max_workers=1)
+        self._closed = False
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    def _build(self, spec: Dict[str, Any]) -> TempVenv:
+        venv = TempVenv(cache=self.cache, cleanup="background", verbose=self.verbose, **spec)
+        venv.__enter__()
+        with self._lock:
+            self.builds += 1
+        return venv
+
+    @staticmethod
+    def _spare_key(spec: Dict[str, Any]) -> str:
+        # Like TempVenv._cache_key, include the file contents so an edited
+        # requirements or lock file is never served by an older spare.
+        digest = hashlib.sha256()
+        for name in ("requirements_file", "lock_file"):
+            if spec.get(name) and Path(spec[name]).is_file():
+                digest.update(name.encode() + b"\0" + Path(spec[name]).read_bytes() + b"\0")
+        return f"{_spec_key(spec)}\0{digest.hexdigest()}"
+
+    def _add_spare(self, key: str, spec: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._closed or len(self._spares.get(key, [])) >= self.spares:
+                return
+        try:
+            venv = self._build(spec)
+        except RuntimeError as e:
+            if self.verbose:
+                print(f"Failed to prebuild an environment: {e}")
+            return
+        with self._lock:
+            if not self._closed:
+                self._spares.setdefault(key, []).append(venv)
+                return
+        venv.__exit__(None, None, None)
+
+    def lease(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Hands out a ready environment for spec and returns its lease, python and path."""
+        unknown = set(spec) - _DAEMON_SPEC_KEYS
+        if unknown:
+            raise ValueError(f"Unsupported spec keys: {', '.join(sorted(unknown))}")
+        for name in _SPEC_PATH_KEYS:
+            if spec.get(name) and not os.path.isabs(spec[name]):
+                raise ValueError(f"{name} must be an absolute path, got {spec[name]!r}")
+        if spec.get("requirements_file") and not Path(spec["requirements_file"]).is_file():
+            raise ValueError(f"Requirements file not found: {spec['requirements_file']}")
+        key = self._spare_key(spec)
+        prefix = key.rsplit("\0", 1)[0] + "\0"
+        with self._lock:
+            spares = self._spares.get(key)
+            venv = spares.pop() if spares else None
+            stale = [k for k in self._spares if k.startswith(prefix) and k != key]
+            outdated = [spare for k in stale for spare in self._spares.pop(k)]
+        for spare in outdated:
+            spare.__exit__(None, None, None)
+        warm = venv is not None
+        if venv is None:
+            venv = self._build(spec)
+        if self.spares:
+            self._refill.submit(self._add_spare, key, spec)
+        lease_id = uuid.uuid4().hex
+        with self._lock:
+            self._leases[lease_id] = venv
+            self.served += 1
+            self.warm_hits += warm
+        return {"lease": lease_id, "python": str(venv.venv_python_executable), "path": venv.temp_dir_path_str, "warm": warm}
+
+    def release(self, lease_id: str) -> None:
+        with self._lock:
+            venv = self._leases.pop(lease_id, None)
+        if venv is None:
+            raise KeyError(f"Unknown lease: {lease_id}")
+        venv.__exit__(None, None, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "leases": len(self._leases),
+                "served": self.served,
+                "warm_hits": self.warm_hits,
+                "builds": self.builds,
+                "spares": sum(len(spares) for spares in self._spares.values()),
+            }
+        if self.cache is not None:
+            stats["cache_entries"] = len(self.cache.entries())
+        return stats
+
+    def handle(self, request: Dict[str, Any], leases: List[str]) -> Dict[str, Any]:
+        """Answers one protocol request. leases collects the connection's leases."""
+        try:
+            op = request.get("op")
+            if op == "lease":
+                response = self.lease(request.get("spec") or {})
+                leases.append(response["lease"])
+            elif op == "release":
+                self.release(request["lease"])
+                if request["lease"] in leases:
+                    leases.remove(request["lease"])
+                response = {}
+            elif op == "stats":
+                response = {"stats": self.stats()}
+            else:
+                raise ValueError(f"Unknown op: {op!r}")
+        except (RuntimeError, ValueError, KeyError, TypeError) as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return dict(response, ok=True)
+
+    def serve_forever(self) -> None:
+        """Listens on the socket until shutdown() is called."""
+        if self.socket_path.exists():
+            try:
+                VenvClient(self.socket_path).close()
+            except OSError:
+                self.socket_path.unlink() # Left behind by a daemon that did not shut down cleanly
+            else:
+                raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                leases: List[str] = []
+                try:
+                    for line in self.rfile:
+                        try:
+                            request = json.loads(line)
+                        except ValueError as e:
+                            response = {"ok": False, "error": f"Invalid request: {e}"}
+                        else:
+                            response = daemon.handle(request, leases)
+                        self.wfile.write((json.dumps(response) + "\n").encode())
+                finally:
+                    # A client that exits or crashes gives its environments back.
+                    for lease_id in leases:
+                        with contextlib.suppress(KeyError):
+                            daemon.release(lease_id)
+
+        self._server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), Handler)
+        self._server.daemon_threads = True
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                self.socket_path.unlink()
+
+    def shutdown(self) -> None:
+        """Stops serve_forever() from another thread."""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self) -> None:
+        """Deletes all spare and leased environments."""
+        with self._lock:
+            self._closed = True
+        self._refill.shutdown(wait=True)
+        with self._lock:
+            venvs = [venv for spares in self._spares.values() for venv in spares] + list(self._leases.values())
+            self._spares.clear()
+            self._leases.clear()
+        for venv in venvs:
+            venv.__exit__(None, None, None)
+
+
+class VenvClient:
+    """
+    A connection to a VenvDaemon. Leases are returned to the daemon when they
+    are released or when the connection is closed.
+    """
+    def __init__(self, socket_path: Union[str, Path], timeout: Optional[float] = None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(str(socket_path))
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile("rw", encoding="utf-8")
+
+    def _request(self, op: str, **fields) -> Dict[str, Any]:
+        self._file.write(json.dumps(dict(fields, op=op)) + "\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise RuntimeError("The daemon closed the connection.")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise RuntimeError(response["error"])
+        return response
+
+    def lease(self, packages: Optional[List[str]] = None, **spec) -> Dict[str, Any]:
+        """
+        Leases a ready environment. Accepts packages and the TempVenv arguments
+        python_executable, python_version, pip_options, venv_options,
+        requirements_file, lock_file, single_pass and wheelhouse (a path).
+
+        Returns:
+            A dict with the lease id, the environment's python and path, and
+            warm, which is True if a prebuilt environment was handed out.
+        """
+        if packages is not None:
+            spec["packages"] = packages
+        return self._request("lease", spec=_absolute_spec_paths(spec))
+
+    def release(self, lease_id: str) -> None:
+        self._request("release", lease=lease_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._request("stats")["stats"]
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _default_cache_dir() -> Path:
+    # Per user: lookup() trusts the entries it finds, so a shared directory would
+    # let other users plant environments.
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return _private_dir(Path(base) / "temp-venv")
+
+
+def _spec_from_args(args: argparse.Namespace) -> Dict[str, Any]:
+    spec: Dict[str, Any] = {}
+    for key in ("packages", "python_executable", "python_version", "pip_options", "requirements_file", "lock_file", "wheelhouse"):
+        value = getattr(args, key)
+        if value:
+            spec[key] = value
+    if args.single_pass:
+        spec["single_pass"] = True
+    return _absolute_spec_paths(spec)
+
+
+def _activated_env(venv_root: str) -> Dict[str, str]:
+    env = os.environ.copy()
+    env.pop("PYTHONHOME", None)
+    env["VIRTUAL_ENV"] = venv_root
+    env["PATH"] = os.pathsep.join([str(_venv_python_path(Path(venv_root)).parent), env.get("PATH", "")])
+    return env
+
+
+def _cli_create(args: argparse.Namespace) -> int:
+    target = Path(args.path) if args.path else Path(tempfile.mkdtemp(prefix="temp_venv-cli-"))
+    cache = None if args.no_cache else (args.cache or _default_cache_dir())
+    with TempVenv(cache=cache, verbose=args.verbose, **_spec_from_args(args)) as venv_python:
+        _clone_tree(Path(venv_python).parent.parent, target)
+    print(_venv_python_path(target))
+    return 0
+
+
+def _cli_run(args: argparse.Namespace) -> int:
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        raise ValueError("No command given to run.")
+    if args.socket:
+        with VenvClient(args.socket) as client:
+            lease = client.lease(**_spec_from_args(args))
+            return subprocess.call(command, env=_activated_env(lease["path"]))
+    cache = None if args.no_cache else (args.cache or _default_cache_dir())
+    with TempVenv(cache=cache, verbose=args.verbose, cleanup="background", **_spec_from_args(args)) as venv_python:
+        return subprocess.call(command, env=_activated_env(str(Path(venv_python).parent.parent)))
+
+
+def _cli_gc(args: argparse.Namespace) -> int:
+    cache = VenvCache(args.cache or _default_cache_dir(), max_size=args.max_size, max_age=args.max_age)
+    evicted = cache.evict()
+    print(f"Evicted {len(evicted)} cached environment(s)")
+    if args.sweep_orphans is not None:
+        removed = sweep_orphans(args.sweep_orphans or None)
+        print(f"Removed {len(removed)} orphaned temporary directory(ies)")
+    if args.store:
+        collected = PackageStore(args.store).gc()
+        print("Pruned the package store" if collected else "Package store is in use, not pruned")
+    return 0
+
+
+def _cli_stats(args: argparse.Namespace) -> int:
+    entries = VenvCache(args.cache or _default_cache_dir()).entries()
+    stats: Dict[str, Any] = {
+        "cache": {"entries": len(entries), "size": sum(info.get("size", 0) for info in entries)},
+    }
+    if args.socket:
+        with VenvClient(args.socket) as client:
+            stats["daemon"] = client.stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"cache: {stats['cache']['entries']} environment(s), {stats['cache']['size'] / 2**20:.1f} MiB")
+        for key, value in stats.get("daemon", {}).items():
+            print(f"daemon {key}: {value}")
+    return 0
+
+
+def _cli_daemon(args: argparse.Namespace) -> int:
+    daemon = VenvDaemon(args.socket, cache=args.cache or _default_cache_dir(), spares=args.spares, verbose=args.verbose)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point of the temp-venv command."""
+    parser = argparse.ArgumentParser(prog="temp-venv", description="Create and serve temporary Python virtual environments.")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+    spec_options = argparse.ArgumentParser(add_help=False)
+    spec_options.add_argument("-p", "--package", dest="packages", action="append", help="A package to install. Repeatable.")
+    spec_options.add_argument("-r", "--requirements", dest="requirements_file", help="A requirements file to install.")
+    spec_options.add_argument("--python", dest="python_executable", help="The base Python executable.")
+    spec_options.add_argument("--python-version", help='A version spec such as ">=3.11" for the base Python.')
+    spec_options.add_argument("--pip-option", dest="pip_options", action="append",
+                              help="An option for uv pip install, e.g. --pip-option=--no-index. Repeatable.")
+    spec_options.add_argument("--lock-file", help="A pinned requirements file, written on first use.")
+    spec_options.add_argument("--wheelhouse", help="Install only from this wheelhouse directory.")
+    spec_options.add_argument("--single-pass", action="store_true", help="Resolve all requirements at once.")
+    spec_options.add_argument("--no-cache", action="store_true", help="Build without the environment cache.")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--cache", help="The environment cache directory. Defaults to $XDG_CACHE_HOME/temp-venv or ~/.cache/temp-venv.")
+    common.add_argument("-v", "--verbose", action="store_true")
+
+    create = subparsers.add_parser("create", parents=[spec_options, common], help="Build an environment and print its Python path.")
+    create.add_argument("path", nargs="?", help="Where to put the environment. A new temporary directory if omitted.")
+    create.set_defaults(handler=_cli_create)
+
+    run = subparsers.add_parser("run", parents=[spec_options, common], help="Run a command in a temporary environment.")
+    run.add_argument("--socket", help="Lease the environment from the daemon listening on this socket.")
+    run.add_argument("command", nargs=argparse.REMAINDER, help="The command, after --.")
+    run.set_defaults(handler=_cli_run)
+
+    gc = subparsers.add_parser("gc", parents=[common], help="Evict cached environments and optionally remove orphaned ones.")
+    gc.add_argument("--sweep-orphans", nargs="?", const="", metavar="TEMP_ROOT",
+                    help="Also remove temporary environments of processes that no longer exist from TEMP_ROOT "
+                         "(default: the system temp directory). Do not sweep a directory shared with other "
+                         "containers or machines: their processes cannot be seen from here and look dead.")
+    gc.add_argument("--max-size", type=int, help="Evict least recently used environments above this many bytes.")
+    gc.add_argument("--max-age", type=float, help="Evict environments older than this many seconds.")
+    gc.add_argument("--store", help="Also prune this package store if nothing uses it.")
+    gc.set_defaults(handler=_cli_gc)
+
+    stats = subparsers.add_parser("stats", parents=[common], help="Show cache and daemon statistics.")
+    stats.add_argument("--socket", help="Also query the daemon listening on this socket.")
+    stats.add_argument("--json", action="store_true", help="Print JSON.")
+    stats.set_defaults(handler=_cli_stats)
+
+    daemon = subparsers.add_parser("daemon", parents=[common], help="Serve ready environments on a Unix socket.")
+    daemon.add_argument("--socket", required=True, help="Path of the socket to listen on.")
+    daemon.add_argument("--spares", type=int, default=1, help="Prebuilt environments kept per spec.")
+    daemon.set_defaults(handler=_cli_daemon)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.handler(args)
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"temp-venv: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
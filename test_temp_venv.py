@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 import subprocess
 import os
 import sys
@@ -6,8 +7,34 @@ import shutil
 import tempfile
 import io
 import contextlib # For redirect_stdout/stderr
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import json
+import threading
+import time
+import asyncio
 from pathlib import Path
-from temp_venv import TempVenv # Assuming temp_venv.py is in the same directory or PYTHONPATH
+import temp_venv
+from benchmark_temp_venv import make_wheel
+from temp_venv import AsyncTempVenv, InterpreterRegistry, PackageStore, TempVenv, TempVenvPool, VenvCache, VenvClient, VenvDaemon, VenvTemplate, Wheelhouse, sweep_orphans, version_matches # Assuming temp_venv.py is in the same directory or PYTHONPATH
+
+
+class OfflineWheelsMixin:
+    """Provides a directory of locally built wheels and pip_options that install only from it."""
+
+    def setUp(self):
+        super().setUp()
+        self._wheel_dir = tempfile.TemporaryDirectory()
+        self.wheel_dir = self._wheel_dir.name
+        for name in ("alpha", "beta"):
+            make_wheel(self.wheel_dir, name)
+        make_wheel(self.wheel_dir, "alpha", "2.0")
+        make_wheel(self.wheel_dir, "gamma", requires=["alpha<2"])
+        self.offline_pip_options = ["--no-index", "--find-links", self.wheel_dir]
+
+    def tearDown(self):
+        self._wheel_dir.cleanup()
+        super().tearDown()
 
 class TestTempVenv(unittest.TestCase):
 
@@ -196,6 +223,12 @@ class TestTempVenv(unittest.TestCase):
         for phrase in expected_phrases:
             self.assertIn(phrase, output, f"Expected phrase '{phrase}' not found in verbose output:\n{output}")
 
+    def test_timeout(self):
+        with self.assertRaises(RuntimeError) as context:
+            with TempVenv(timeout=0.001):
+                pass
+        self.assertIn("timed out", str(context.exception))
+
     def test_verbose_output_cleanup_false(self):
         stdout_capture = io.StringIO()
         temp_dir_path = None
@@ -215,6 +248,1114 @@ class TestTempVenv(unittest.TestCase):
                 if self.get_verbose_setting_from_env(): print(f"Manually cleaning up {temp_dir_path} for test_verbose_output_cleanup_false")
                 shutil.rmtree(temp_dir_path)
 
+
+class TestVenvCache(OfflineWheelsMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self._cache_dir.name
+
+    def tearDown(self):
+        self._cache_dir.cleanup()
+        super().tearDown()
+
+    def _enter_verbose(self, venv):
+        stdout_capture = io.StringIO()
+        with contextlib.redirect_stdout(stdout_capture):
+            venv_python = venv.__enter__()
+        return venv_python, stdout_capture.getvalue()
+
+    def test_cache_hit_skips_installer(self):
+        with TempVenv(packages=["alpha==1.0"], pip_options=self.offline_pip_options, cache=self.cache_dir):
+            pass
+        venv = TempVenv(packages=["alpha==1.0"], pip_options=self.offline_pip_options, cache=self.cache_dir, verbose=True)
+        venv_python, output = self._enter_verbose(venv)
+        try:
+            self.assertIn("Cache hit", output)
+            self.assertNotIn("uv installing", output)
+            self.assertNotIn("uv venv creation", output)
+            result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "1.0")
+            # Console scripts must be relocated to the new environment.
+            script = Path(venv_python).parent / "alpha-cli"
+            self.assertIn(venv.temp_dir_path_str, script.read_text().splitlines()[0])
+            result = subprocess.run([str(script)], capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "alpha 1.0")
+        finally:
+            venv.__exit__(None, None, None)
+
+    def test_different_specs_do_not_share_entries(self):
+        with TempVenv(packages=["alpha==1.0"], pip_options=self.offline_pip_options, cache=self.cache_dir):
+            pass
+        venv = TempVenv(packages=["alpha==2.0"], pip_options=self.offline_pip_options, cache=self.cache_dir, verbose=True)
+        venv_python, output = self._enter_verbose(venv)
+        try:
+            self.assertIn("Cache miss", output)
+            result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "2.0")
+        finally:
+            venv.__exit__(None, None, None)
+        self.assertEqual(len(VenvCache(self.cache_dir).entries()), 2)
+
+    def test_key_normalizes_package_order_and_whitespace(self):
+        key_a = VenvCache.make_key("3.11", ["beta", "alpha == 1.0"], None, [], [])
+        key_b = VenvCache.make_key("3.11", ["alpha==1.0", "beta"], None, [], [])
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_a, VenvCache.make_key("3.12", ["alpha==1.0", "beta"], None, [], []))
+        self.assertNotEqual(key_a, VenvCache.make_key("3.11", ["alpha==1.0", "beta"], "six\n", [], []))
+
+    def test_size_and_age_eviction(self):
+        with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, cache=VenvCache(self.cache_dir, max_size=0)):
+            pass
+        self.assertEqual(VenvCache(self.cache_dir).entries(), [])
+
+        with TempVenv(packages=["beta"], pip_options=self.offline_pip_options, cache=self.cache_dir):
+            pass
+        cache = VenvCache(self.cache_dir, max_age=0)
+        self.assertEqual(len(cache.evict()), 1)
+        self.assertEqual(cache.entries(), [])
+
+    def test_evict_skips_locked_entries(self):
+        with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, cache=self.cache_dir):
+            pass
+        cache = VenvCache(self.cache_dir, max_size=0)
+        key = cache.entries()[0]["key"]
+        with cache.lock(key):
+            self.assertEqual(cache.evict(), [])
+        self.assertEqual(cache.evict(), [key])
+
+
+    def test_cache_hits_clone_under_a_shared_lock(self):
+        with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, cache=self.cache_dir):
+            pass
+        cache = VenvCache(self.cache_dir, max_size=0)
+        key = cache.entries()[0]["key"]
+        with cache.lock(key, shared=True):
+            # Another hit must not wait for this one, and eviction must leave the entry alone.
+            hit = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, cache=self.cache_dir)
+            thread = threading.Thread(target=lambda: (hit.__enter__(), hit.__exit__(None, None, None)))
+            thread.start()
+            thread.join(60)
+            self.assertFalse(thread.is_alive())
+            self.assertTrue(hit.cache_hit)
+            self.assertEqual(cache.evict(), [])
+
+class TestSinglePassInstall(OfflineWheelsMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.requirements_file = os.path.join(self._work_dir.name, "requirements.txt")
+        with open(self.requirements_file, "w") as f:
+            f.write("alpha\nbeta\n")
+        self.lock_file = os.path.join(self._work_dir.name, "requirements.lock")
+
+    def tearDown(self):
+        self._work_dir.cleanup()
+        super().tearDown()
+
+    def _build(self, **kwargs):
+        stdout_capture = io.StringIO()
+        with contextlib.redirect_stdout(stdout_capture):
+            with TempVenv(requirements_file=self.requirements_file, pip_options=self.offline_pip_options, verbose=True, **kwargs) as venv_python:
+                result = subprocess.run([venv_python, "-c", "import alpha, beta; print(alpha.__version__)"],
+                                        capture_output=True, text=True, check=True)
+        return result.stdout.strip(), stdout_capture.getvalue()
+
+    def test_single_pass_resolves_once(self):
+        alpha_version, output = self._build(packages=["gamma"], single_pass=True)
+        self.assertEqual(alpha_version, "1.0")
+        self.assertEqual(output.count("-m uv pip install"), 1)
+        self.assertIn("in a single pass", output)
+
+    def test_lock_file_is_created_then_reused(self):
+        alpha_version, output = self._build(packages=["gamma"], lock_file=self.lock_file)
+        self.assertEqual(alpha_version, "1.0")
+        self.assertIn("-m uv pip compile", output)
+        lock_text = Path(self.lock_file).read_text()
+        self.assertIn("alpha==1.0", lock_text)
+        self.assertIn("gamma==1.0", lock_text)
+
+        # With the lock present, the pins win and nothing is resolved, even though gamma is gone.
+        alpha_version, output = self._build(lock_file=self.lock_file)
+        self.assertEqual(alpha_version, "1.0")
+        self.assertNotIn("uv pip compile", output)
+        self.assertIn("Installing pinned packages from lock file", output)
+
+    def test_concurrent_builds_share_one_lock_file(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            def build(_):
+                venv = TempVenv(requirements_file=self.requirements_file, packages=["gamma"], pip_options=self.offline_pip_options,
+                                lock_file=self.lock_file, cache=cache_dir)
+                with venv:
+                    return venv.cache_hit
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(build, range(4)))
+            self.assertIn("gamma==1.0", Path(self.lock_file).read_text())
+            self.assertEqual(sorted(os.listdir(self._work_dir.name)), ["requirements.lock", "requirements.lock.lock", "requirements.txt"])
+            # The first build was stored under the key of the resolved pins, so the next one hits.
+            self.assertTrue(build(None))
+
+
+class TestWheelhouse(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_installs_only_from_wheelhouse(self):
+        with TempVenv(packages=["gamma"], wheelhouse=self.wheel_dir) as venv_python:
+            result = subprocess.run([venv_python, "-c", "import alpha, gamma; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "1.0")
+
+    def test_missing_top_level_artifact_is_named(self):
+        with self.assertRaises(RuntimeError) as context:
+            with TempVenv(packages=["alpha", "Not_There>=1.0", "six"], wheelhouse=self.wheel_dir):
+                pass
+        self.assertEqual(str(context.exception), f"Wheelhouse {self.wheel_dir} has no artifact for: not-there, six")
+
+    def test_missing_dependency_is_named(self):
+        os.remove(os.path.join(self.wheel_dir, "alpha-1.0-py3-none-any.whl"))
+        os.remove(os.path.join(self.wheel_dir, "alpha-2.0-py3-none-any.whl"))
+        with self.assertRaises(RuntimeError) as context:
+            with TempVenv(packages=["gamma"], wheelhouse=self.wheel_dir):
+                pass
+        self.assertIn("has no artifact for: alpha", str(context.exception))
+
+    def test_requirement_parsing(self):
+        wheelhouse = Wheelhouse(self.wheel_dir)
+        self.assertEqual(wheelhouse.project_names(), {"alpha", "beta", "gamma"})
+        self.assertEqual(wheelhouse.missing(["ALPHA[extra]>=1; python_version>'3'", "beta @ file:///x", "-e ./local", "./local-dir"]), [])
+
+    def test_prefetch_then_install_offline(self):
+        with tempfile.TemporaryDirectory() as wheelhouse_dir:
+            wheelhouse = Wheelhouse(wheelhouse_dir)
+            artifacts = wheelhouse.prefetch(packages=["six==1.16.0"])
+            self.assertTrue(any(artifact.name.startswith("six-1.16.0") for artifact in artifacts))
+            with TempVenv(packages=["six==1.16.0"], wheelhouse=wheelhouse, pip_options=["--offline"]) as venv_python:
+                subprocess.run([venv_python, "-c", "import six"], check=True)
+
+
+class TestLazyTempVenv(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_background_build(self):
+        venv = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, lazy="background")
+        with venv as venv_python:
+            self.assertTrue(venv_python.started)
+            result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "2.0")
+            self.assertTrue(venv_python.ready())
+            self.assertEqual(str(venv_python), os.fspath(venv_python))
+            venv_root = Path(venv.temp_dir_path_str)
+        self.assertFalse(venv_root.exists())
+
+    def test_on_demand_build_is_skipped_when_unused(self):
+        stdout_capture = io.StringIO()
+        with contextlib.redirect_stdout(stdout_capture):
+            venv = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, lazy="on_demand", verbose=True)
+            with venv as venv_python:
+                self.assertFalse(venv_python.started)
+        self.assertEqual(stdout_capture.getvalue(), "")
+        self.assertIsNone(venv.temp_dir_path_str)
+        with self.assertRaises(RuntimeError):
+            venv_python.wait()
+
+    def test_on_demand_build_on_first_use(self):
+        with TempVenv(packages=["alpha==1.0"], pip_options=self.offline_pip_options, lazy="on_demand") as venv_python:
+            self.assertTrue(Path(venv_python).is_file())
+            self.assertTrue(venv_python.ready())
+
+    def test_setup_error_is_raised_on_use(self):
+        with TempVenv(packages=["missing-package"], pip_options=self.offline_pip_options, lazy="background") as venv_python:
+            with self.assertRaises(RuntimeError) as context:
+                venv_python.wait()
+            self.assertIn("missing-package", str(context.exception))
+
+
+class TestPhaseTimings(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_phases_are_recorded_and_reported(self):
+        reported = []
+        with tempfile.TemporaryDirectory() as trace_dir:
+            trace_file = os.path.join(trace_dir, "trace.json")
+            venv = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options,
+                            on_phase=lambda name, duration: reported.append((name, duration)), trace_file=trace_file)
+            with venv:
+                pass
+            with open(trace_file) as f:
+                trace = json.load(f)
+        for phase in ("tempdir", "discover", "create", "install", "install.resolve", "install.install", "cleanup"):
+            self.assertIn(phase, venv.timings)
+            self.assertGreaterEqual(venv.timings[phase], 0)
+        self.assertEqual([name for name, _ in reported], [event["name"] for event in venv.trace_events])
+        self.assertEqual(len(trace["traceEvents"]), len(reported))
+        for event in trace["traceEvents"]:
+            self.assertEqual(event["ph"], "X")
+            self.assertGreaterEqual(event["ts"], 0)
+
+    def test_uv_summary_parsing(self):
+        venv = TempVenv()
+        venv._record_uv_phases("Resolved 3 packages in 12ms\nPrepared 2 packages in 1.5s\nInstalled 3 packages in 250µs\n", 0.0)
+        self.assertAlmostEqual(venv.timings["install.resolve"], 0.012)
+        self.assertAlmostEqual(venv.timings["install.download"], 1.5)
+        self.assertAlmostEqual(venv.timings["install.install"], 0.00025)
+        self.assertEqual([event["start"] for event in venv.trace_events], [0.0, 0.012, 1.512])
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_benchmark_smoke_run_writes_comparable_results(self):
+        import benchmark_temp_venv
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, "results.json")
+            args = ["--scenarios", "cold_create", "cleanup_large", "--repeat", "1", "--warmup", "0",
+                    "--packages", "2", "--large-modules", "10"]
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                benchmark_temp_venv.main(args + ["--output", output])
+                stdout_capture = io.StringIO()
+                with contextlib.redirect_stdout(stdout_capture):
+                    benchmark_temp_venv.main(args + ["--compare", output])
+            with open(output) as f:
+                results = json.load(f)
+        self.assertEqual(set(results["results"]), {"cold_create", "cleanup_large"})
+        self.assertIn("commit", results["meta"])
+        self.assertIn("change", stdout_capture.getvalue())
+
+
+class TestInterpreterRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.work_dir = Path(self._work_dir.name)
+
+    def tearDown(self):
+        self._work_dir.cleanup()
+
+    def test_probe_is_cached_and_shared(self):
+        registry = InterpreterRegistry()
+        info = registry.probe(sys.executable)
+        self.assertEqual(info.version, tuple(sys.version_info[:3]))
+        self.assertEqual(info.implementation, sys.implementation.name)
+        self.assertEqual(registry.probe(sys.executable), info)
+        python_version = f"=={sys.version_info[0]}.{sys.version_info[1]}"
+        with TempVenv(python_version=python_version, registry=registry):
+            pass
+        probes = registry.probes
+        with TempVenv(python_version=python_version, registry=registry):
+            pass
+        with TempVenv(registry=registry):
+            pass
+        self.assertEqual(registry.probes, probes)
+
+    @unittest.skipIf(os.name == "nt", "uses a shell script as a stand-in interpreter")
+    def test_changed_binary_is_probed_again(self):
+        wrapper = self.work_dir / "python-wrapper"
+        wrapper.write_text(f"#!/bin/sh\nexec {sys.executable} \"$@\"\n")
+        wrapper.chmod(0o755)
+        registry = InterpreterRegistry()
+        registry.probe(str(wrapper))
+        registry.probe(str(wrapper))
+        self.assertEqual(registry.probes, 1)
+        wrapper.write_text(f"#!/bin/sh\n# changed\nexec {sys.executable} \"$@\"\n")
+        registry.probe(str(wrapper))
+        self.assertEqual(registry.probes, 2)
+
+    def test_registry_persists_to_disk(self):
+        path = self.work_dir / "interpreters.json"
+        InterpreterRegistry(path).probe(sys.executable)
+        registry = InterpreterRegistry(path)
+        registry.probe(sys.executable)
+        self.assertEqual(registry.probes, 0)
+
+    def test_version_spec(self):
+        self.assertTrue(version_matches((3, 11, 7), ">=3.11"))
+        self.assertTrue(version_matches((3, 11, 7), "3.11"))
+        self.assertTrue(version_matches((3, 11, 7), "==3.11.*"))
+        self.assertTrue(version_matches((3, 11, 7), ">=3.9, <3.12"))
+        self.assertTrue(version_matches((3, 11, 7), "~=3.10"))
+        self.assertFalse(version_matches((3, 11, 7), "~=3.11.8"))
+        self.assertFalse(version_matches((3, 11, 7), "!=3.11"))
+        self.assertFalse(version_matches((3, 11, 7), ">3.11.7"))
+        with self.assertRaises(ValueError):
+            version_matches((3, 11, 7), ">=three")
+
+    def test_unmatched_version_spec(self):
+        with self.assertRaises(RuntimeError) as context:
+            with TempVenv(python_version=">=99"):
+                pass
+        self.assertIn(">=99", str(context.exception))
+
+
+class TestVenvWorkers(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_run_and_call_share_warm_worker(self):
+        venv = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, workers=1)
+        with venv as venv_python:
+            self.assertEqual(venv.run("import alpha, sys\nprint(alpha.__version__)\nprint(sys.executable)").split(),
+                             ["2.0", venv_python])
+            # Globals and imports persist between calls.
+            venv.run("counter = 41")
+            self.assertEqual(venv.run("counter += 1; print(counter)").strip(), "42")
+            self.assertEqual(venv.call("os.path", "join", "a", "b"), os.path.join("a", "b"))
+            self.assertEqual(venv.call("alpha", "main"), None)
+            pid = venv.call("os", "getpid")
+            self.assertEqual(venv.call("os", "getpid"), pid)
+        self.assertIsNone(venv.worker_pool)
+
+    def test_worker_errors_are_reported(self):
+        venv = TempVenv()
+        with venv:
+            with self.assertRaises(RuntimeError) as context:
+                venv.run("raise ValueError('boom')")
+            self.assertIn("ValueError in worker: boom", str(context.exception))
+            with self.assertRaises(RuntimeError) as context:
+                venv.call("a_truly_non_existent_module", "f")
+            self.assertIn("ModuleNotFoundError", str(context.exception))
+            # Output written straight to the file descriptors must not break the protocol.
+            venv.run("import os, sys; os.write(1, b'noise\\n'); sys.stdin.read()")
+            self.assertEqual(venv.run("print('still fine')").strip(), "still fine")
+
+    def test_worker_pool_serves_parallel_callers(self):
+        venv = TempVenv(workers=3)
+        with venv:
+            self.assertEqual(len(venv.worker_pool._workers), 3)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                pids = set(executor.map(lambda _: venv.call("time", "sleep", 0.3) or venv.call("os", "getpid"), range(3)))
+            self.assertGreaterEqual(len(pids), 2)
+
+    def test_waiters_survive_dead_workers_and_close(self):
+        pool = temp_venv.VenvWorkerPool(sys.executable, size=1)
+        results = {}
+
+        def run(name, code):
+            try:
+                results[name] = pool.run(code)
+            except RuntimeError as e:
+                results[name] = e
+
+        def start(name, code):
+            thread = threading.Thread(target=run, args=(name, code))
+            thread.start()
+            return thread
+
+        def wait_until_busy():
+            while not pool._workers or pool._idle:
+                time.sleep(0.01)
+
+        dying = start("dying", "import os, time; time.sleep(0.5); os._exit(1)")
+        wait_until_busy()
+        waiting = start("waiting", "print('hi')")
+        dying.join()
+        waiting.join(timeout=30)
+        self.assertFalse(waiting.is_alive())
+        self.assertIsInstance(results["dying"], RuntimeError)
+        self.assertEqual(results["waiting"].strip(), "hi")
+
+        busy = start("busy", "import time; time.sleep(0.5)")
+        wait_until_busy()
+        waiting = start("closed", "print('hi')")
+        time.sleep(0.1)
+        pool.close()
+        waiting.join(timeout=30)
+        busy.join()
+        self.assertFalse(waiting.is_alive())
+        self.assertIsInstance(results["closed"], RuntimeError)
+
+    def test_run_outside_with_block(self):
+        with self.assertRaises(RuntimeError):
+            TempVenv().run("print(1)")
+
+    def test_lazy_build_and_first_run_share_one_pool(self):
+        created = []
+        original = temp_venv.VenvWorkerPool
+
+        def tracking_pool(*args, **kwargs):
+            created.append(original(*args, **kwargs))
+            return created[-1]
+        with mock.patch.object(temp_venv, "VenvWorkerPool", tracking_pool):
+            venv = TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, lazy="background", workers=1)
+            with venv:
+                # Called while the background build, which starts the workers, is still running.
+                self.assertEqual(venv.run("import alpha; print(alpha.__version__)").strip(), "2.0")
+        self.assertEqual(len(created), 1)
+        self.assertIsNone(venv.worker_pool)
+
+
+class TestReconfigure(OfflineWheelsMixin, unittest.TestCase):
+
+    def _alpha_version(self, venv_python):
+        result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+
+    def test_reconfigure_applies_only_the_delta(self):
+        venv = TempVenv(packages=["alpha==2.0", "beta"], pip_options=self.offline_pip_options)
+        with venv as venv_python:
+            snapshot = venv.snapshot()
+            self.assertEqual(snapshot, ["alpha==2.0", "beta==1.0"])
+            diff = venv.reconfigure(["gamma"])
+            self.assertEqual(diff, {"installed": ["gamma==1.0"], "removed": ["beta==1.0"], "changed": ["alpha==2.0 -> alpha==1.0"]})
+            self.assertEqual(self._alpha_version(venv_python), "1.0")
+            self.assertEqual(venv.packages, ["gamma"])
+
+            diff = venv.reconfigure(["gamma", "beta"])
+            self.assertEqual(diff, {"installed": ["beta==1.0"], "removed": [], "changed": []})
+
+            stdout_capture = io.StringIO()
+            venv.verbose = True
+            with contextlib.redirect_stdout(stdout_capture):
+                diff = venv.rollback(snapshot)
+            self.assertNotIn("uv pip compile", stdout_capture.getvalue())
+            self.assertEqual(diff, {"installed": [], "removed": ["gamma==1.0"], "changed": ["alpha==1.0 -> alpha==2.0"]})
+            self.assertEqual(venv.snapshot(), snapshot)
+            self.assertEqual(self._alpha_version(venv_python), "2.0")
+
+    def test_reconfigure_restarts_workers(self):
+        venv = TempVenv(packages=["alpha==1.0"], pip_options=self.offline_pip_options, workers=1)
+        with venv:
+            self.assertEqual(venv.run("import alpha; print(alpha.__version__)").strip(), "1.0")
+            venv.reconfigure(["alpha==2.0"])
+            self.assertEqual(venv.run("import alpha; print(alpha.__version__)").strip(), "2.0")
+
+    def test_reconfigure_requires_entered_environment(self):
+        with self.assertRaises(RuntimeError):
+            TempVenv().reconfigure(["alpha"])
+
+
+class TestBackgroundCleanup(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_root = tempfile.TemporaryDirectory()
+        self.temp_root = Path(self._temp_root.name)
+
+    def tearDown(self):
+        self._temp_root.cleanup()
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        return process.pid
+
+    def test_background_cleanup_removes_directory(self):
+        venv = TempVenv(cleanup="background")
+        with venv:
+            venv_root = Path(venv.temp_dir_path_str)
+            self.assertTrue(venv_root.name.startswith(f"temp_venv-{os.getpid()}-"))
+        self.assertFalse(venv_root.exists())
+        temp_venv._reaper.drain()
+        self.assertEqual(list((venv_root.parent / "temp_venv-trash").glob(f"{venv_root.name}-*")), [])
+
+    def test_unknown_cleanup_mode(self):
+        with self.assertRaises(ValueError):
+            TempVenv(cleanup="later")
+
+    def test_falsy_cleanup_keeps_directory(self):
+        venv = TempVenv(cleanup=None)
+        with venv:
+            pass
+        self.assertTrue(Path(venv.temp_dir_path_str).is_dir())
+        shutil.rmtree(venv.temp_dir_path_str)
+
+    def test_sweep_removes_only_orphans(self):
+        dead_pid = self.dead_pid()
+        orphan = self.temp_root / f"temp_venv-{dead_pid}-abc"
+        trashed = self.temp_root / "temp_venv-trash" / f"temp_venv-{dead_pid}-def-1234"
+        live = self.temp_root / f"temp_venv-{os.getpid()}-ghi"
+        unrelated = self.temp_root / "unrelated"
+        for directory in (orphan, trashed, live, unrelated):
+            (directory / "lib").mkdir(parents=True)
+        self.assertEqual(sorted(sweep_orphans(self.temp_root)), sorted([orphan, trashed]))
+        self.assertFalse(orphan.exists())
+        self.assertFalse(trashed.exists())
+        self.assertTrue(live.exists())
+        self.assertTrue(unrelated.exists())
+
+    def test_sweep_removes_environment_of_killed_process(self):
+        script = ("import os\nfrom temp_venv import TempVenv\nvenv = TempVenv()\nvenv.__enter__()\n"
+                  "print(venv.temp_dir_path_str, flush=True)\nos._exit(1)\n")
+        env = dict(os.environ, TMPDIR=str(self.temp_root), TEMP=str(self.temp_root), TMP=str(self.temp_root))
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        orphan = Path(result.stdout.strip())
+        self.assertEqual(orphan.parent, self.temp_root)
+        self.assertTrue(orphan.is_dir())
+        self.assertEqual(sweep_orphans(self.temp_root), [orphan])
+        self.assertFalse(orphan.exists())
+
+
+class TestPackageStore(OfflineWheelsMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._store_dir = tempfile.TemporaryDirectory()
+        self.store = PackageStore(self._store_dir.name)
+
+    def tearDown(self):
+        self._store_dir.cleanup()
+        super().tearDown()
+
+    def installed_file(self, venv_python):
+        result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__file__)"],
+                                capture_output=True, text=True, check=True)
+        return os.stat(result.stdout.strip())
+
+    def test_environments_share_package_files(self):
+        with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, store=self.store) as first_python:
+            with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, store=self.store) as second_python:
+                first, second = self.installed_file(first_python), self.installed_file(second_python)
+                self.assertEqual((first.st_dev, first.st_ino), (second.st_dev, second.st_ino))
+                self.assertEqual(len(self.store.references()), 2)
+                self.assertFalse(self.store.gc())
+        self.assertEqual(self.store.references(), [])
+        self.assertTrue(self.store.gc())
+
+    def test_stale_references_do_not_block_gc(self):
+        ref = self.store.register(os.path.join(self._store_dir.name, "gone"))
+        self.assertEqual(self.store.references(), [])
+        self.assertFalse(ref.exists())
+        self.assertTrue(self.store.gc(full=True))
+
+    def test_unknown_link_mode(self):
+        with self.assertRaises(ValueError):
+            PackageStore(self._store_dir.name, link_mode="move")
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "needs POSIX ownership")
+    def test_default_store_is_private(self):
+        with mock.patch.object(tempfile, "gettempdir", return_value=self._store_dir.name):
+            store = PackageStore()
+            self.assertEqual(store.path.name, f"temp_venv-store-{os.getuid()}")
+            self.assertEqual(store.path.stat().st_mode & 0o777, 0o700)
+            store.path.chmod(0o777)
+            with self.assertRaises(RuntimeError):
+                PackageStore()
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm") and os.stat("/dev/shm").st_dev != os.stat(tempfile.gettempdir()).st_dev,
+                         "needs a second filesystem")
+    def test_store_on_another_filesystem_copies(self):
+        with tempfile.TemporaryDirectory(dir="/dev/shm") as store_dir:
+            store = PackageStore(store_dir)
+            with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options, store=store) as venv_python:
+                self.assertEqual(store.link_mode_for(Path(venv_python).parent), "copy")
+                self.assertEqual(self.installed_file(venv_python).st_nlink, 1)
+
+
+class TestStreamingOutput(OfflineWheelsMixin, unittest.TestCase):
+
+    def print_lines(self, count, stream="stdout", exit_code=0):
+        return [sys.executable, "-c", f"import sys\nfor i in range({count}): print('line', i, file=sys.{stream})\nsys.exit({exit_code})"]
+
+    def test_output_is_delivered_while_running(self):
+        arrivals = []
+        venv = TempVenv(on_output=lambda description, line: arrivals.append((time.monotonic(), description, line)))
+        command = [sys.executable, "-c", "import time\nprint('started', flush=True)\ntime.sleep(1)"]
+        venv._run_subprocess(command, "slow command")
+        finished = time.monotonic()
+        self.assertEqual([(description, line) for _, description, line in arrivals], [("slow command", "started")])
+        self.assertLess(arrivals[0][0], finished - 0.5)
+
+    def test_only_the_tail_is_kept(self):
+        venv = TempVenv()
+        result = venv._run_subprocess(self.print_lines(1000), "chatty command")
+        lines = result.stdout.splitlines()
+        self.assertEqual(lines[0], f"[{1000 - TempVenv.OUTPUT_TAIL_LINES} earlier lines omitted]")
+        self.assertEqual(len(lines), TempVenv.OUTPUT_TAIL_LINES + 1)
+        self.assertEqual(lines[-1], "line 999")
+        full = venv._run_subprocess(self.print_lines(1000), "chatty command", keep_output=True)
+        self.assertEqual(len(full.stdout.splitlines()), 1000)
+
+    def test_uv_summaries_survive_a_long_install(self):
+        for index in range(TempVenv.OUTPUT_TAIL_LINES + 50):
+            make_wheel(self.wheel_dir, f"bulk{index}")
+        packages = [f"bulk{index}" for index in range(TempVenv.OUTPUT_TAIL_LINES + 50)]
+        venv = TempVenv(packages=packages, pip_options=self.offline_pip_options)
+        with venv:
+            pass
+        self.assertIn("install.resolve", venv.timings)
+        self.assertIn("install.install", venv.timings)
+
+    def test_error_report_is_bounded(self):
+        venv = TempVenv()
+        with self.assertRaises(RuntimeError) as context:
+            with venv._setup_errors():
+                venv._run_subprocess(self.print_lines(5000, "stderr", exit_code=1), "failing command")
+        message = str(context.exception)
+        self.assertIn("line 4999", message)
+        self.assertNotIn("line 0\n", message)
+        self.assertLess(len(message), 10000)
+
+    def test_install_output_is_streamed(self):
+        received = []
+        with TempVenv(packages=["alpha"], pip_options=self.offline_pip_options,
+                      on_output=lambda description, line: received.append((description, line))):
+            pass
+        self.assertTrue(any("alpha" in line for description, line in received if "install" in description))
+
+    def test_async_output_is_streamed(self):
+        received = []
+
+        async def build():
+            async with AsyncTempVenv(packages=["alpha"], pip_options=self.offline_pip_options,
+                                     on_output=lambda description, line: received.append(line)):
+                pass
+        asyncio.run(build())
+        self.assertTrue(any("alpha" in line for line in received))
+
+
+class TestPytestPlugin(OfflineWheelsMixin, unittest.TestCase):
+
+    TESTS = """
+import os, subprocess
+
+OPTIONS = ["--no-index", "--find-links", os.environ["TEMP_VENV_WHEELS"]]
+
+def version(python):
+    return subprocess.run([python, "-c", "import alpha; print(alpha.__version__)"],
+                          capture_output=True, text=True, check=True).stdout.strip()
+
+def test_first(temp_venv):
+    assert version(temp_venv(packages=["alpha==1.0"], pip_options=OPTIONS)) == "1.0"
+
+def test_clones_are_private(temp_venv):
+    first = temp_venv(packages=["alpha==1.0"], pip_options=OPTIONS)
+    second = temp_venv(packages=["alpha==1.0"], pip_options=OPTIONS)
+    assert first != second
+    subprocess.run(["uv", "pip", "uninstall", "alpha", "--python", first], check=True, capture_output=True)
+    assert version(second) == "1.0"
+
+def test_session(temp_venv_session):
+    assert temp_venv_session(packages=["alpha==1.0"], pip_options=OPTIONS) == temp_venv_session(packages=["alpha==1.0"], pip_options=OPTIONS)
+"""
+
+    def run_pytest(self, *args):
+        with tempfile.TemporaryDirectory() as test_dir:
+            Path(test_dir, "test_plugin_usage.py").write_text(self.TESTS)
+            env = dict(os.environ, TEMP_VENV_WHEELS=self.wheel_dir,
+                       PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")])))
+            env["PATH"] = os.pathsep.join([os.path.dirname(sys.executable), env.get("PATH", "")])
+            return subprocess.run([sys.executable, "-m", "pytest", "-p", "pytest_temp_venv", "-p", "no:cacheprovider",
+                                   "--basetemp", os.path.join(test_dir, "basetemp"), *args, test_dir],
+                                  capture_output=True, text=True, env=env, cwd=test_dir)
+
+    def test_specs_are_built_once_and_cloned(self):
+        result = self.run_pytest()
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn("temp_venv summary", result.stdout)
+        self.assertRegex(result.stdout, r"4 environments: 1 built in [\d.]+s, 3 reused in [\d.]+s")
+
+    @unittest.skipUnless(importlib.util.find_spec("xdist"), "pytest-xdist is not installed")
+    def test_xdist_workers_share_builds(self):
+        result = self.run_pytest("-n", "2")
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertRegex(result.stdout, r"4 environments: 1 built in [\d.]+s, 3 reused in [\d.]+s")
+
+
+class TestCommandLine(OfflineWheelsMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.work_dir = Path(self._work_dir.name)
+        self.cache_args = ["--cache", str(self.work_dir / "cache")]
+        self.spec_args = ["-p", "alpha==1.0", "--pip-option=--no-index", f"--pip-option=--find-links={self.wheel_dir}"]
+
+    def tearDown(self):
+        self._work_dir.cleanup()
+        super().tearDown()
+
+    def main(self, *args):
+        stdout_capture = io.StringIO()
+        with contextlib.redirect_stdout(stdout_capture):
+            exit_code = temp_venv.main(list(args))
+        return exit_code, stdout_capture.getvalue()
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "needs POSIX ownership")
+    def test_default_cache_is_private(self):
+        cache_dir = self.work_dir / "xdg" / "temp-venv"
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": str(self.work_dir / "xdg")}):
+            self.assertEqual(self.main("stats", "--json")[0], 0)
+            self.assertEqual(cache_dir.stat().st_mode & 0o777, 0o700)
+            cache_dir.chmod(0o777)
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(self.main("stats", "--json")[0], 1)
+
+    def test_create_stats_and_gc(self):
+        target = self.work_dir / "env"
+        exit_code, output = self.main("create", str(target), *self.spec_args, *self.cache_args)
+        self.assertEqual(exit_code, 0)
+        venv_python = output.strip()
+        self.assertTrue(venv_python.startswith(str(target)))
+        result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "1.0")
+
+        exit_code, output = self.main("stats", "--json", *self.cache_args)
+        self.assertEqual(json.loads(output)["cache"]["entries"], 1)
+        exit_code, output = self.main("gc", "--max-age", "0", *self.cache_args)
+        self.assertIn("Evicted 1 cached environment(s)", output)
+        self.assertNotIn("orphaned", output)
+        self.assertEqual(VenvCache(self.work_dir / "cache").entries(), [])
+        self.assertTrue(Path(venv_python).exists())
+
+    def test_gc_sweeps_orphans_only_when_asked(self):
+        orphan = self.work_dir / "temp_venv-999999999-env"
+        orphan.mkdir()
+        with mock.patch.object(temp_venv, "sweep_orphans", wraps=temp_venv.sweep_orphans) as sweep:
+            self.main("gc", *self.cache_args)
+            sweep.assert_not_called()
+            exit_code, output = self.main("gc", "--sweep-orphans", str(self.work_dir), *self.cache_args)
+        self.assertEqual(exit_code, 0)
+        self.assertIn("Removed 1 orphaned temporary directory(ies)", output)
+        self.assertFalse(orphan.exists())
+
+    def test_run_returns_command_exit_code(self):
+        code = "import os, sys, alpha; sys.exit(3 if os.environ['VIRTUAL_ENV'] in sys.prefix else 1)"
+        exit_code, _ = self.main("run", *self.spec_args, *self.cache_args, "--", "python", "-c", code)
+        self.assertEqual(exit_code, 3)
+
+    def test_setup_errors_are_reported(self):
+        stderr_capture = io.StringIO()
+        with contextlib.redirect_stderr(stderr_capture):
+            exit_code, _ = self.main("run", "-p", "missing-package", "--pip-option=--no-index", "--no-cache", "--", "python", "-V")
+        self.assertEqual(exit_code, 1)
+        self.assertIn("missing-package", stderr_capture.getvalue())
+
+
+@unittest.skipUnless(hasattr(__import__("socket"), "AF_UNIX"), "needs Unix domain sockets")
+class TestVenvDaemon(OfflineWheelsMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.socket_path = Path(self._work_dir.name) / "daemon.sock"
+        self.daemon = VenvDaemon(self.socket_path, cache=Path(self._work_dir.name) / "cache")
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        while not self.socket_path.exists():
+            time.sleep(0.01)
+        self.spec = {"packages": ["alpha==1.0"], "pip_options": self.offline_pip_options}
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        self.daemon.close()
+        self._work_dir.cleanup()
+        super().tearDown()
+
+    def wait_for_stats(self, client, key, value):
+        deadline = time.monotonic() + 60
+        while client.stats()[key] != value:
+            self.assertLess(time.monotonic(), deadline, f"daemon never reached {key}={value}")
+            time.sleep(0.05)
+
+    def test_leases_are_served_warm_and_released(self):
+        with VenvClient(self.socket_path) as client:
+            first = client.lease(**self.spec)
+            self.assertFalse(first["warm"])
+            self.wait_for_stats(client, "spares", 1)
+            second = client.lease(**self.spec)
+            self.assertTrue(second["warm"])
+            self.assertNotEqual(first["path"], second["path"])
+            result = subprocess.run([second["python"], "-c", "import alpha; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "1.0")
+            client.release(first["lease"])
+            self.assertFalse(Path(first["path"]).exists())
+            stats = client.stats()
+            self.assertEqual((stats["leases"], stats["served"], stats["warm_hits"]), (1, 2, 1))
+            with self.assertRaises(RuntimeError):
+                client.release(first["lease"])
+            with self.assertRaises(RuntimeError):
+                client.lease(cache="/elsewhere")
+        with VenvClient(self.socket_path) as client:
+            self.wait_for_stats(client, "leases", 0)
+        # The lease is dropped before its environment is removed.
+        deadline = time.monotonic() + 60
+        while Path(second["path"]).exists():
+            self.assertLess(time.monotonic(), deadline, "leased environment was never removed")
+            time.sleep(0.05)
+
+    def test_edited_requirements_are_not_served_by_stale_spares(self):
+        requirements = Path(self._work_dir.name) / "requirements.txt"
+        requirements.write_text("alpha==1.0\n")
+        spec = {"pip_options": self.offline_pip_options, "requirements_file": "requirements.txt"}
+        original_cwd = os.getcwd()
+        os.chdir(self._work_dir.name)
+        try:
+            with VenvClient(self.socket_path) as client:
+                client.lease(**spec)
+                self.wait_for_stats(client, "spares", 1)
+                requirements.write_text("alpha==2.0\n")
+                lease = client.lease(**spec)
+                self.assertFalse(lease["warm"])
+                result = subprocess.run([lease["python"], "-c", "import alpha; print(alpha.__version__)"],
+                                        capture_output=True, text=True, check=True)
+                self.assertEqual(result.stdout.strip(), "2.0")
+        finally:
+            os.chdir(original_cwd)
+
+    def test_relative_and_missing_paths_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.daemon.lease({"requirements_file": "requirements.txt"})
+        with self.assertRaises(ValueError):
+            self.daemon.lease({"wheelhouse": "wheels"})
+        with self.assertRaises(ValueError):
+            self.daemon.lease({"requirements_file": str(Path(self._work_dir.name) / "missing.txt")})
+
+    def test_second_daemon_is_refused(self):
+        with self.assertRaises(RuntimeError):
+            VenvDaemon(self.socket_path).serve_forever()
+
+    def test_cli_run_leases_from_daemon(self):
+        args = ["run", "--socket", str(self.socket_path), "-p", "alpha==1.0", "--pip-option=--no-index",
+                f"--pip-option=--find-links={self.wheel_dir}", "--", "python", "-c", "import alpha, sys; sys.exit(4)"]
+        self.assertEqual(temp_venv.main(args), 4)
+        with VenvClient(self.socket_path) as client:
+            self.wait_for_stats(client, "leases", 0)
+
+
+class TestCreateMany(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_batch_dedupes_and_reports_failures(self):
+        specs = [
+            {"packages": ["alpha==1.0", "beta"], "pip_options": self.offline_pip_options},
+            {"packages": ["beta", "alpha==1.0"], "pip_options": self.offline_pip_options},
+            {"packages": ["alpha==2.0"], "pip_options": self.offline_pip_options},
+            {"packages": ["missing-package"], "pip_options": self.offline_pip_options},
+        ]
+        results = list(TempVenv.create_many(specs, max_workers=3))
+        try:
+            self.assertEqual(len(results), 3)
+            by_packages = {tuple(result.spec["packages"]): result for result in results}
+            self.assertEqual(by_packages[("alpha==1.0", "beta")].count, 2)
+            failed = by_packages[("missing-package",)]
+            self.assertFalse(failed.ok)
+            self.assertIsInstance(failed.error, RuntimeError)
+            self.assertIsNone(failed.venv)
+            for result in results:
+                self.assertGreater(result.elapsed, 0)
+            built = by_packages[("alpha==2.0",)]
+            self.assertTrue(built.ok)
+            output = subprocess.run([built.python, "-c", "import alpha; print(alpha.__version__)"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(output.stdout.strip(), "2.0")
+        finally:
+            for result in results:
+                result.close()
+        self.assertFalse(Path(built.python).exists())
+
+    def test_invalid_specs_fail_alone(self):
+        specs = [
+            {"packages": ["alpha==1.0"], "pip_options": self.offline_pip_options},
+            {"cleanup": "later"},
+            {"pakages": ["alpha"]},
+        ]
+        results = list(TempVenv.create_many(specs, max_workers=3))
+        try:
+            errors = {tuple(result.spec): type(result.error) for result in results if not result.ok}
+            self.assertEqual(errors, {("cleanup",): ValueError, ("pakages",): TypeError})
+            self.assertEqual([result.spec for result in results if result.ok], specs[:1])
+        finally:
+            for result in results:
+                result.close()
+
+    def test_stopping_early_cleans_up_remaining(self):
+        specs = [{"packages": [f"alpha=={version}"], "pip_options": self.offline_pip_options} for version in ("1.0", "2.0")]
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            original_tempdir = tempfile.tempdir
+            tempfile.tempdir = scratch_dir
+            try:
+                batch = TempVenv.create_many(specs, max_workers=2)
+                first = next(batch)
+                batch.close()
+                self.assertTrue(first.ok)
+                self.assertEqual(len(os.listdir(scratch_dir)), 1)
+                first.close()
+                self.assertEqual(os.listdir(scratch_dir), [])
+            finally:
+                tempfile.tempdir = original_tempdir
+
+
+class TestTempVenvPool(OfflineWheelsMixin, unittest.TestCase):
+
+    def test_pool_hit_after_warm(self):
+        with TempVenvPool(size=1) as pool:
+            pool.warm()
+            self.assertTrue(pool.wait_ready(timeout=60))
+            with TempVenv(pool=pool) as venv_python:
+                self.assertTrue(Path(venv_python).is_file())
+                result = subprocess.run([venv_python, "-c", "print('pooled')"], capture_output=True, text=True, check=True)
+                self.assertEqual(result.stdout.strip(), "pooled")
+            self.assertEqual((pool.hits, pool.misses), (1, 0))
+
+    def test_pool_rejects_cleanup_false(self):
+        with TempVenvPool(size=1) as pool:
+            with self.assertRaises(ValueError):
+                TempVenv(pool=pool, cleanup=False)
+
+    def test_pool_honours_python_version(self):
+        current = f"{sys.version_info[0]}.{sys.version_info[1]}"
+        with TempVenvPool(size=1) as pool:
+            with self.assertRaises(RuntimeError) as context:
+                with TempVenv(pool=pool, python_version="==2.7"):
+                    pass
+            self.assertIn("==2.7", str(context.exception))
+            with TempVenv(pool=pool, python_version=f"=={current}") as venv_python:
+                result = subprocess.run([venv_python, "-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+                                        capture_output=True, text=True, check=True)
+                self.assertEqual(result.stdout.strip(), current)
+
+    def test_pool_miss_and_discard_on_release(self):
+        with TempVenvPool(size=1) as pool:
+            venv = TempVenv(pool=pool, packages=["alpha"], pip_options=self.offline_pip_options)
+            with venv as venv_python:
+                venv_root = Path(venv.temp_dir_path_str)
+                subprocess.run([venv_python, "-c", "import alpha"], check=True)
+            self.assertEqual((pool.hits, pool.misses), (0, 1))
+            self.assertFalse(venv_root.exists())
+
+    def test_reset_on_release_returns_pristine_environment(self):
+        with TempVenvPool(size=1, reset_on_release=True) as pool:
+            venv = TempVenv(pool=pool, packages=["alpha"], pip_options=self.offline_pip_options)
+            with venv:
+                venv_root = Path(venv.temp_dir_path_str)
+            self.assertTrue(venv_root.exists())
+            venv_python = str(venv_root / "bin" / "python") if os.name != "nt" else str(venv_root / "Scripts" / "python.exe")
+            result = subprocess.run([venv_python, "-c", "import alpha"], capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertEqual(pool.stats()["idle"][TempVenvPool.make_key(None, None)], 1)
+        self.assertFalse(venv_root.exists())
+
+
+class TestVenvTemplate(OfflineWheelsMixin, unittest.TestCase):
+
+    def _site_file(self, venv_python, module):
+        result = subprocess.run([venv_python, "-c", f"import {module}; print({module}.__file__)"],
+                                capture_output=True, text=True, check=True)
+        return Path(result.stdout.strip())
+
+    def test_clone_installs_only_delta(self):
+        with VenvTemplate(packages=["alpha==1.0"], pip_options=self.offline_pip_options) as template:
+            stdout_capture = io.StringIO()
+            with contextlib.redirect_stdout(stdout_capture):
+                with TempVenv(template=template, packages=["beta"], pip_options=self.offline_pip_options, verbose=True) as venv_python:
+                    subprocess.run([venv_python, "-c", "import alpha, beta"], check=True)
+                    script = Path(venv_python).parent / "alpha-cli"
+                    result = subprocess.run([str(script)], capture_output=True, text=True, check=True)
+                    self.assertEqual(result.stdout.strip(), "alpha 1.0")
+            output = stdout_capture.getvalue()
+            self.assertIn("Cloning template environment", output)
+            self.assertNotIn("uv venv creation", output)
+            self.assertIn("Installing specified packages using uv: beta", output)
+
+    def test_clones_are_isolated_from_template(self):
+        with VenvTemplate(packages=["alpha==1.0"], pip_options=self.offline_pip_options) as template:
+            with TempVenv(template=template, link_mode="hardlink") as venv_python:
+                clone_file = self._site_file(venv_python, "alpha")
+                if os.name != "nt":
+                    self.assertEqual(clone_file.stat().st_mode & 0o222, 0, "shared package files must be read-only")
+            with TempVenv(template=template, link_mode="copy") as venv_python:
+                with open(self._site_file(venv_python, "alpha"), "a") as f:
+                    f.write("corrupted = True\n")
+            with TempVenv(template=template, packages=["alpha==2.0"], pip_options=self.offline_pip_options) as venv_python:
+                result = subprocess.run([venv_python, "-c", "import alpha; print(alpha.__version__)"],
+                                        capture_output=True, text=True, check=True)
+                self.assertEqual(result.stdout.strip(), "2.0")
+            template_python = template.path / ("Scripts/python.exe" if os.name == "nt" else "bin/python")
+            result = subprocess.run([str(template_python), "-c", "import alpha; print(alpha.__version__); print(hasattr(alpha, 'corrupted'))"],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.split(), ["1.0", "False"])
+
+    def test_writes_through_default_link_mode_do_not_reach_sources(self):
+        def append_to_alpha(venv_python):
+            try:
+                with open(self._site_file(venv_python, "alpha"), "a") as f:
+                    f.write("corrupted = True\n")
+            except PermissionError:
+                pass # A read-only hardlink; only root could write through it, and root gets copies
+
+        def corrupted(venv_python):
+            result = subprocess.run([str(venv_python), "-c", "import alpha; print(hasattr(alpha, 'corrupted'))"],
+                                    capture_output=True, text=True, check=True)
+            return result.stdout.strip() == "True"
+
+        with VenvTemplate(packages=["alpha==1.0"], pip_options=self.offline_pip_options) as template:
+            with TempVenv(template=template) as venv_python:
+                append_to_alpha(venv_python)
+            self.assertFalse(corrupted(template.path / ("Scripts/python.exe" if os.name == "nt" else "bin/python")))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            spec = dict(packages=["alpha==1.0"], pip_options=self.offline_pip_options, cache=cache_dir)
+            with TempVenv(**spec):
+                pass
+            hit = TempVenv(**spec)
+            with hit as venv_python:
+                self.assertTrue(hit.cache_hit)
+                append_to_alpha(venv_python)
+            with TempVenv(**spec) as venv_python:
+                self.assertFalse(corrupted(venv_python))
+
+    def test_template_rejects_cache_and_pool(self):
+        with self.assertRaises(ValueError):
+            TempVenv(template=VenvTemplate(), cache="unused")
+
+
+class TestAsyncTempVenv(OfflineWheelsMixin, unittest.IsolatedAsyncioTestCase):
+
+    async def test_async_creation_and_cleanup(self):
+        venv = AsyncTempVenv(packages=["alpha"], pip_options=self.offline_pip_options)
+        async with venv as venv_python:
+            process = await asyncio.create_subprocess_exec(venv_python, "-c", "import alpha; print(alpha.__version__)",
+                                                           stdout=asyncio.subprocess.PIPE)
+            stdout, _ = await process.communicate()
+            self.assertEqual(stdout.decode().strip(), "2.0")
+            venv_root = Path(venv.temp_dir_path_str)
+        self.assertFalse(venv_root.exists())
+
+    async def test_event_loop_keeps_running_during_build(self):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker_task = asyncio.create_task(ticker())
+        try:
+            venvs = [AsyncTempVenv(packages=[name], pip_options=self.offline_pip_options) for name in ("alpha", "beta")]
+            async with venvs[0], venvs[1]:
+                pass
+        finally:
+            ticker_task.cancel()
+        self.assertGreater(ticks, 5)
+
+    async def test_invalid_package_name(self):
+        invalid_package = "thispackagedoesnotexistandshouldfailpipinstall"
+        with self.assertRaises(RuntimeError) as context:
+            async with AsyncTempVenv(packages=[invalid_package], pip_options=self.offline_pip_options):
+                pass
+        self.assertIn("Error during virtual environment setup", str(context.exception))
+        self.assertIn(invalid_package, str(context.exception))
+
+    async def test_timeout(self):
+        with self.assertRaises(RuntimeError) as context:
+            async with AsyncTempVenv(timeout=0.001):
+                pass
+        self.assertIn("timed out", str(context.exception))
+
+    async def test_cancellation_removes_temp_dir(self):
+        venv = AsyncTempVenv(packages=["alpha"], pip_options=self.offline_pip_options)
+        task = asyncio.create_task(venv.__aenter__())
+        await asyncio.sleep(0.05)
+        temp_dir_path = venv.temp_dir_path_str
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertFalse(Path(temp_dir_path).exists())
+
+    def test_rejects_cache(self):
+        with self.assertRaises(ValueError):
+            AsyncTempVenv(cache="unused")
+
 # Removed ensure_pip related tests:
 # - test_ensure_pip_false_no_pip_initially
 # - test_ensure_pip_true_explicitly